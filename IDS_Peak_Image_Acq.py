@@ -12,17 +12,74 @@
 # supplied.
 #
 
-from ids_peak import ids_peak
-from ids_peak_ipl import ids_peak_ipl
+# the IDS peak libraries are only needed to acquire images, post processing runs without them (e.g. headless on Linux)
+try:
+    from ids_peak import ids_peak
+    from ids_peak_ipl import ids_peak_ipl
+except ImportError:
+    ids_peak = None
+    ids_peak_ipl = None
 import numpy as np
 import cv2
 import os
 from datetime import datetime
 import time
+import math
+import json
+from datetime import timedelta
 import sys
+from frame import Frame, format_time
+from frame_stack import FrameStackWriter, FrameStack, STACK_FILENAME
+from artifact_writer import ArtifactWriter
+from camera import CameraBackend
+from scheduler import AcquisitionSchedule, CATCH_UP, SKIP
 
 VERSION = "1.0.0"
 MODEL = "U3-356xXLE-M"
+SCHEDULE_FILENAME = "Acquisition_Schedule.json"
+
+class IDSPeakBackend(CameraBackend):
+    """ The IDS peak camera backend: the library, the device manager and the image conversion of the IDS peak libraries."""
+    def __init__(self):
+        assert (ids_peak is not None), "IDS peak libraries not installed, image acquisition is not available"
+        super().__init__()
+        self.__device = None
+
+    def now(self):
+        return datetime.now()
+
+    def initialize(self):
+        ids_peak.Library.Initialize()
+
+    def close(self):
+        ids_peak.Library.Close()
+
+    def open_device(self, model):
+        # create a device manager object and update it
+        device_manager = ids_peak.DeviceManager.Instance()
+        device_manager.Update()
+        if device_manager.Devices().empty():
+            return None
+
+        # list all available devices
+        selected_device = None
+        for i, device in enumerate(device_manager.Devices()):
+            print(str(i) + ": " + device.ModelName() + " ("
+                  + device.ParentInterface().DisplayName() + "; "
+                  + device.ParentInterface().ParentSystem().DisplayName() + "v."
+                  + device.ParentInterface().ParentSystem().Version() + ")")
+            if device.ModelName() == model:
+                selected_device = int(i)
+
+        # open selected device, its remote device node map and data stream
+        self.__device = device_manager.Devices()[selected_device].OpenDevice(ids_peak.DeviceAccessType_Control)
+        nodemap_remote_device = self.__device.RemoteDevice().NodeMaps()[0]
+        return nodemap_remote_device, self.__device.DataStreams()[0].OpenDataStream()
+
+    def get_image(self, buffer):
+        raw_image = ids_peak_ipl.Image.CreateFromSizeAndBuffer(buffer.PixelFormat(), buffer.BasePtr(), buffer.Size(), buffer.Width(), buffer.Height())
+        return raw_image.get_numpy_3D()
+
 
 def set_roi(nodemap_remote_device):
     """This function changes the roi for the image pixel size. It is currently set to the max pixel size."""
@@ -60,46 +117,55 @@ def initialize_directory(directory = "./Images/"):
 
     return directory
 
-def image_acquisition(period = 5, image_acquisitions = 5, directory = "./Images/", progressbar = None, gain = 5, exposure_time = 763108.0):
+def image_acquisition(period = 5, image_acquisitions = 5, directory = "./Images/", progressbar = None, gain = 5, exposure_time = 763108.0, return_frames = False, frame_stack = False,
+                      png_compression = 1, writer_queue = 8, backend = None, schedule_policy = CATCH_UP, frame_rate = None, ring_buffers = None):
     """This is the main image acquistion function. The function initializes the ids_peak libray and finds the camera device. 
-    It sets the exposure, resolution, and analog_gain. For image acquisition, it images for n number of image acquistions at a period of n period."""
+    It sets the exposure, resolution, and analog_gain. For image acquisition, it images for n number of image acquistions at a period of n period.
+    Returns the saved image paths, or with return_frames the decoded Frames (still saved to disk) so post processing does not read the files back.
+    With frame_stack the frames are appended to one frame stack in the directory instead of a PNG file each (see frame_stack.py)
+    and the memory-mapped frames of the stack are returned.
+    Each frame is copied out of its camera buffer and the buffer is queued again straight away; the PNG encode (at png_compression)
+    or stack append runs on a background ArtifactWriter holding at most writer_queue frames, so the disk does not delay the acquisition period.
+    The writer backlog is printed with every frame and its throughput at the end, and the writer statistics are saved with the schedule in the run metadata.
+    backend is the CameraBackend of the camera (see camera.py), the IDS peak camera by default; the SyntheticBackend and ReplayBackend
+    stand-ins run the acquisition without the camera, on their own (optionally faster) clock.
+    The acquisitions are triggered at fixed deadlines from the start (see scheduler.py), a late acquisition does not shift the later ones;
+    schedule_policy says whether a missed deadline is caught up (CATCH_UP) or skipped (SKIP). Each frame's planned and actual time and jitter
+    are saved in the run metadata (the frame stack header, or SCHEDULE_FILENAME next to the PNG files).
+    With frame_rate (fps) the camera free-runs instead: it streams image_acquisitions frames at AcquisitionFrameRate without triggers (period is
+    not used), for sub-second kinetics. The stream is drained into a ring of ring_buffers reusable buffers (default one second of frames),
+    the frame times (with milliseconds) come from the camera timestamps and frames the ring had no buffer for are counted as dropped.
+    The writer queue then holds the whole burst (writer_queue is not used), so writing the frames does not hold up the ring."""
     
-    # Make sure period and image acquisition parameters are valid
-    assert (period >= 1), "Period parameter invalid, must be >= 1 second"
+    # Make sure period and image acquisition parameters are valid (free-run frames are timed by the camera)
+    assert (frame_rate is not None or period >= 1), "Period parameter invalid, must be >= 1 second"
+    assert (frame_rate is None or frame_rate > 0), "Frame rate parameter invalid, must be > 0"
     assert (image_acquisitions > 0), "Image acquisitions parameter invalid"
 
+    # the U3-356xXLE-M unless another camera backend is given
+    if backend is None:
+        backend = IDSPeakBackend()
+
     print("Ids_Peak_Image_Acq-Python_" + VERSION)
 
     # initialize library
-    ids_peak.Library.Initialize()
-
-    # create a device manager object
-    device_manager = ids_peak.DeviceManager.Instance()
+    backend.initialize()
+    stack_writer = None
+    writer = None
+    writer_stats = None
+    schedule = None
+    image_arr = []
+    free_run = frame_rate is not None
 
     try:
-        # update the device manager
-        device_manager.Update()
-
-        # exit program if no device was found
-        if device_manager.Devices().empty():
+        # open the camera, exit program if no device was found
+        opened = backend.open_device(MODEL)
+        if opened is None:
             print("No device found. Exiting Program.")
             return
 
-        # list all available devices
-        selected_device = None
-        for i, device in enumerate(device_manager.Devices()):
-            print(str(i) + ": " + device.ModelName() + " ("
-                  + device.ParentInterface().DisplayName() + "; "
-                  + device.ParentInterface().ParentSystem().DisplayName() + "v."
-                  + device.ParentInterface().ParentSystem().Version() + ")")
-            if device.ModelName() == MODEL:
-                selected_device = int(i)
-
-        # open selected device
-        device = device_manager.Devices()[selected_device].OpenDevice(ids_peak.DeviceAccessType_Control)
-
-        # get the remote device node map
-        nodemap_remote_device = device.RemoteDevice().NodeMaps()[0]
+        # get the remote device node map and the data stream
+        nodemap_remote_device, dataStream = opened
 
         # print model name and user ID
         print("Model Name: " + nodemap_remote_device.FindNode("DeviceModelName").Value())
@@ -108,7 +174,7 @@ def image_acquisition(period = 5, image_acquisitions = 5, directory = "./Images/
         # print sensor information, not knowing if device has the node "SensorName"
         try:
             print("Sensor Name: " + nodemap_remote_device.FindNode("SensorName").Value())
-        except ids_peak.Exception:
+        except Exception:
             print("Sensor Name: " + "(unknown)")
 
         # print resolution
@@ -119,14 +185,15 @@ def image_acquisition(period = 5, image_acquisitions = 5, directory = "./Images/
         # Set roi to max pixel sensor size
         set_roi(nodemap_remote_device)
 
-        # open the data stream
-        dataStream = device.DataStreams()[0].OpenDataStream()
-
-        #allocate and announce image buffers
+        #allocate and announce image buffers, free-running a ring of them is reused (each is queued again once its frame is copied)
         payloadSize = nodemap_remote_device.FindNode("PayloadSize").Value()
         bufferCountMin = dataStream.NumBuffersAnnouncedMinRequired()
+        if free_run:
+            buffer_count = max(bufferCountMin, ring_buffers if ring_buffers is not None else math.ceil(frame_rate))
+        else:
+            buffer_count = max(bufferCountMin, image_acquisitions)
         
-        for _ in range(max(bufferCountMin, image_acquisitions)):
+        for _ in range(buffer_count):
             buffer = dataStream.AllocAndAnnounceBuffer(payloadSize)
             dataStream.QueueBuffer(buffer)
 
@@ -137,8 +204,12 @@ def image_acquisition(period = 5, image_acquisitions = 5, directory = "./Images/
         
         # prepare for untriggered continuous image acquisition
         nodemap_remote_device.FindNode("TriggerSelector").SetCurrentEntry("ExposureStart")
-        nodemap_remote_device.FindNode("TriggerMode").SetCurrentEntry("On")
-        nodemap_remote_device.FindNode("TriggerSource").SetCurrentEntry("Software")
+        if free_run:
+            # the camera streams at the frame rate
+            nodemap_remote_device.FindNode("TriggerMode").SetCurrentEntry("Off")
+        else:
+            nodemap_remote_device.FindNode("TriggerMode").SetCurrentEntry("On")
+            nodemap_remote_device.FindNode("TriggerSource").SetCurrentEntry("Software")
 
 
         # set gain 
@@ -152,12 +223,6 @@ def image_acquisition(period = 5, image_acquisitions = 5, directory = "./Images/
         # print(f"MaxGain: {maxgain}")
         # print(f"Mingain: {mingain}")
 
-        # set frame rate
-        # min_frame_rate = nodemap_remote_device.FindNode("AcquisitionFrameRate").Minimum()
-        # nodemap_remote_device.FindNode("AcquisitionFrameRate").SetValue(min_frame_rate)
-        frame_rate = nodemap_remote_device.FindNode("AcquisitionFrameRate").Value()
-        print(f"Frame Rate: {frame_rate} fps")
-
         # modify exposure time
         # maxExp = nodemap_remote_device.FindNode("ExposureTime").Maximum()
         # minExp = nodemap_remote_device.FindNode("ExposureTime").Minimum()
@@ -167,9 +232,23 @@ def image_acquisition(period = 5, image_acquisitions = 5, directory = "./Images/
         exposure = nodemap_remote_device.FindNode("ExposureTime").Value()
         print(f"Exposure Time: {exposure} us")
 
+        # set frame rate (after the exposure time, which limits it)
+        # min_frame_rate = nodemap_remote_device.FindNode("AcquisitionFrameRate").Minimum()
+        # nodemap_remote_device.FindNode("AcquisitionFrameRate").SetValue(min_frame_rate)
+        if free_run:
+            max_frame_rate = nodemap_remote_device.FindNode("AcquisitionFrameRate").Maximum()
+            assert (frame_rate <= max_frame_rate), f"Frame rate parameter invalid, must be <= {max_frame_rate} fps at this exposure time"
+            nodemap_remote_device.FindNode("AcquisitionFrameRate").SetValue(frame_rate)
+        frame_rate = nodemap_remote_device.FindNode("AcquisitionFrameRate").Value()
+        print(f"Frame Rate: {frame_rate} fps")
+
         #initialize image directory
         directory = initialize_directory(directory = directory)
-        image_arr = []
+
+        # encode and write the frames in the background (one worker keeps the stack appends in order)
+        # a free-run burst is held in memory rather than waiting for the disk, a full queue would stop the buffers being queued again and drop frames
+        writer = ArtifactWriter(image_format="png", compression=png_compression, workers=1 if frame_stack else 2,
+                                max_queue=image_acquisitions if free_run else writer_queue)
         try:
             # process the acquired images
             image_count = 1
@@ -179,6 +258,14 @@ def image_acquisition(period = 5, image_acquisitions = 5, directory = "./Images/
 
             dataStream.StartAcquisition()
             nodemap_remote_device.FindNode("AcquisitionStart").Execute()
+
+            # acquisition n is due period * n after the first, on the backend's monotonic clock
+            # (free-running frame n is due n frame periods after the first on the camera clock, a skipped slot is a dropped frame)
+            if free_run:
+                schedule = AcquisitionSchedule(1 / frame_rate, policy=SKIP, clock=backend.time, sleep=backend.sleep)
+            else:
+                schedule = AcquisitionSchedule(period, policy=schedule_policy, clock=backend.time, sleep=backend.sleep)
+                schedule.start()
             
             # update gui progress bar
             if progressbar:
@@ -188,53 +275,72 @@ def image_acquisition(period = 5, image_acquisitions = 5, directory = "./Images/
 
             while image_count <= image_acquisitions:
 
-                ti0 = time.time()
-                nodemap_remote_device.FindNode("TriggerSoftware").Execute()
+                if free_run:
+                    # take the next streamed frame
+                    buffer = dataStream.WaitForFinishedBuffer(int(max(5000, 3000 / frame_rate)))
+                else:
+                    # wait for the acquisition's deadline
+                    slot = schedule.wait()
+                    if slot["jitter"] > period / 10:
+                        print(f"Image Acquisition Late: {slot['jitter']:.3f} seconds")
+                    nodemap_remote_device.FindNode("TriggerSoftware").Execute()
 
-                # get buffer from datastream 
-                buffer = dataStream.WaitForFinishedBuffer(5000)
-                raw_image = ids_peak_ipl.Image.CreateFromSizeAndBuffer(buffer.PixelFormat(), buffer.BasePtr(), buffer.Size(), buffer.Width(), buffer.Height())
+                    # get buffer from datastream 
+                    buffer = dataStream.WaitForFinishedBuffer(5000)
 
                 print(f"Image Acquired: {image_count}")
 
                 # get the time acquired
-                time_acquired = datetime.now().strftime('%Y_%m_%d_%H-%M-%S')
-
-                # convert raw image to numpy 3D array
-                np_image = raw_image.get_numpy_3D()
+                if free_run:
+                    # from the camera timestamp, relative to the wall clock time the first frame arrived
+                    timestamp = buffer.Timestamp_ns() / 1e9
+                    if image_count == 1:
+                        first_timestamp, first_now, first_frame_id = timestamp, backend.now(), buffer.FrameID()
+                        schedule.start(at=timestamp)
+                    schedule.record(timestamp, slot=buffer.FrameID() - first_frame_id)
+                    now = first_now + timedelta(seconds=timestamp - first_timestamp)
+                else:
+                    now = backend.now()
+                time_acquired = now.strftime('%Y_%m_%d_%H-%M-%S')
+                acquired = format_time(now, subsecond=free_run)
+
+                # copy the image out of the camera buffer and queue the buffer again straight away
+                np_image = backend.get_image(buffer).copy()
+                dataStream.QueueBuffer(buffer)
 
-                # save image in directory
-                destination = directory + time_acquired + f"_Acq_{image_count}.png"
-                cv2.imwrite(destination, np_image)
-                image_arr.append(destination)
-                print(f"Image Saved: {image_count}")
+                if frame_stack:
+                    # append to the run's frame stack, allocated for the whole run on the first frame
+                    if stack_writer is None:
+                        stack_writer = FrameStackWriter(directory + STACK_FILENAME, shape=np_image.shape[:2], capacity=image_acquisitions, dtype=np_image.dtype,
+                                                        metadata={"gain": gain, "exposure": exposure, "period": 1 / frame_rate if free_run else period,
+                                                                  "frame_rate": frame_rate if free_run else None})
+                    writer.submit(stack_writer.append, np_image, acquired, image_count)
+                else:
+                    # save image in directory
+                    destination = writer.write(directory + time_acquired + f"_Acq_{image_count}", np_image)
+                    if return_frames:
+                        image_arr.append(Frame(np_image, path=destination, acquired=acquired, index=image_count))
+                    else:
+                        image_arr.append(destination)
+                print(f"Image Queued: {image_count} | Writer Backlog: {writer.get_backlog()}")
 
                 # uncomment to show images
                 # cv2.imshow('image', np_image) 
                 # cv2.waitKey(0)          
-                
-                # queue buffer  
-                dataStream.QueueBuffer(buffer)
 
                 # increase the image counter
                 image_count += 1
 
-
-                # Image Wait Time for Desired Period
-                ti1 = time.time()
-                try:
-                    if (image_count <= image_acquisitions):
-                        print(f"Image wait time: {period - (ti1-ti0)} seconds")
-                        time.sleep(period - (ti1-ti0))
-                except:
-                    print("Image Acquisition Took Too Long")
-
                 # update gui progress bar
                 if progressbar:
                     progress += 1/image_acquisitions
                     progressbar.set(progress)
                     progressbar.update_idletasks()
 
+            # stop acquisition (the camera stops streaming when free-running)
+            nodemap_remote_device.FindNode("AcquisitionStop").Execute()
+            dataStream.StopAcquisition()
+
         except Exception as e:
             print(e)
                         
@@ -244,7 +350,31 @@ def image_acquisition(period = 5, image_acquisitions = 5, directory = "./Images/
         print("Stopping Imaging")
 
     finally:
-        ids_peak.Library.Close()
+        backend.close()
+        if writer is not None:
+            # wait for the queued frames to be written
+            writer.close()
+            writer_stats = writer.get_stats()
+            throughput = f"{writer_stats['throughput']:.2f}" if writer_stats['throughput'] else "-"
+            print(f"Frames Written: {writer_stats['written']} | Peak Writer Backlog: {writer_stats['peak_backlog']} | Blocked: {writer_stats['blocked_time']:.3f} s | Writer Throughput: {throughput} frames/s")
+        if schedule is not None and schedule.get_records():
+            # save the planned and actual acquisition times with the run, and the writer backlog and throughput they were achieved with
+            timing = schedule.as_dict()
+            timing["writer"] = writer_stats
+            if free_run:
+                timing["frame_rate"] = frame_rate
+                print(f"Free-Run: {frame_rate} fps | Dropped Frames: {timing['missed']} | Max Jitter: {timing['max_jitter']:.4f} s | Mean Jitter: {timing['mean_jitter']:.4f} s")
+            else:
+                print(f"Schedule: {timing['policy']} | Missed Deadlines: {timing['missed']} | Max Jitter: {timing['max_jitter']:.3f} s | Mean Jitter: {timing['mean_jitter']:.3f} s")
+            if stack_writer is not None:
+                stack_writer.set_metadata("schedule", timing)
+            else:
+                with open(directory + SCHEDULE_FILENAME, "w") as f:
+                    json.dump(timing, f, indent=2)
+        if stack_writer is not None:
+            # hand over the memory-mapped frames of the stack
+            stack_writer.close()
+            image_arr = FrameStack(stack_writer.get_path()).get_frames()
         print("Image Acquisition Complete")
         return image_arr
 
@@ -0,0 +1,171 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import cv2
+import queue
+import threading
+import time
+
+# supported artifact formats: file extension and the cv2.imwrite compression parameter
+FORMATS = {
+    "png": (".png", cv2.IMWRITE_PNG_COMPRESSION),    # level 0 (none) to 9 (smallest)
+    "tiff": (".tif", cv2.IMWRITE_TIFF_COMPRESSION),  # 1 is uncompressed, 5 is LZW
+    "bmp": (".bmp", None),                           # uncompressed
+}
+
+
+class ArtifactWriter:
+    """ Background image writer. Images are queued with write() and encoded and saved by worker threads,
+    so saving artifacts overlaps with the analysis instead of stalling it. The queue is bounded, so a slow disk
+    applies back pressure rather than holding an unbounded number of frames in memory.
+    Call flush() as a barrier before the files are needed and close() when done.
+    Other writes (e.g. frame stack appends) can be queued with submit(); with one worker they run in the order they were queued.
+    The backlog, the time callers were blocked by a full queue and the throughput of the workers are tracked (see get_stats).
+    """
+    def __init__(self, image_format = "png", compression = 1, workers = 2, max_queue = 16):
+        assert image_format in FORMATS, "Artifact image format not valid"
+        assert workers > 0, "Artifact writer needs at least one worker"
+        self.__image_format = image_format
+        self.__compression = compression
+        self.__queue = queue.Queue(maxsize=max_queue)
+        self.__errors = []
+        self.__lock = threading.Lock()
+        self.__written = 0
+        self.__busy_time = 0.0
+        self.__blocked_time = 0.0
+        self.__peak_backlog = 0
+        self.__started = time.perf_counter()
+        self.__workers = [threading.Thread(target=self.__run, daemon=True) for _ in range(workers)]
+        for worker in self.__workers:
+            worker.start()
+
+    def get_image_format(self):
+        return self.__image_format
+
+    def get_compression(self):
+        return self.__compression
+
+    def get_extension(self):
+        return FORMATS[self.__image_format][0]
+
+    def get_backlog(self):
+        return self.__queue.qsize()
+
+    def get_peak_backlog(self):
+        return self.__peak_backlog
+
+    def get_written(self):
+        return self.__written
+
+    def get_blocked_time(self):
+        return self.__blocked_time
+
+    def get_stats(self):
+        """ This function returns the writer statistics: items written, the current and peak backlog, the seconds write() and submit()
+        blocked on a full queue, the seconds the workers spent writing and the throughput in items per second of worker time and of wall time.
+        """
+        with self.__lock:
+            written, busy_time = self.__written, self.__busy_time
+        elapsed = time.perf_counter() - self.__started
+        return {
+            "written": written,
+            "backlog": self.get_backlog(),
+            "peak_backlog": self.__peak_backlog,
+            "blocked_time": self.__blocked_time,
+            "busy_time": busy_time,
+            "throughput": written / busy_time if busy_time > 0 else None,
+            "wall_throughput": written / elapsed if elapsed > 0 else None,
+        }
+
+    def get_params(self):
+        """ This function returns the cv2.imwrite parameters for the format and compression level."""
+        flag = FORMATS[self.__image_format][1]
+        return [] if flag is None else [flag, self.__compression]
+
+    def write(self, path, img):
+        """ This function queues an image to be saved to path (without extension) and returns the full file path.
+        The image must not be modified after it is queued. Blocks while the queue is full.
+        """
+        destination = path + self.get_extension()
+        self.submit(self.__imwrite, destination, img)
+        return destination
+
+    def submit(self, function, *args):
+        """ This function queues function(*args) to run on a worker thread. The arguments must not be modified after they are queued.
+        Blocks while the queue is full.
+        """
+        assert self.__workers, "Artifact writer is closed"
+        try:
+            self.__queue.put_nowait((function, args))
+        except queue.Full:
+            blocked = time.perf_counter()
+            self.__queue.put((function, args))
+            self.__blocked_time += time.perf_counter() - blocked
+        self.__peak_backlog = max(self.__peak_backlog, self.__queue.qsize())
+
+    def __imwrite(self, destination, img):
+        if not cv2.imwrite(destination, img, self.get_params()):
+            raise IOError(f"Image could not be written: {destination}")
+
+    def __run(self):
+        while True:
+            item = self.__queue.get()
+            try:
+                if item is None:
+                    return
+                function, args = item
+                start = time.perf_counter()
+                function(*args)
+                with self.__lock:
+                    self.__written += 1
+                    self.__busy_time += time.perf_counter() - start
+            except Exception as e:
+                with self.__lock:
+                    self.__errors.append(e)
+            finally:
+                self.__queue.task_done()
+
+    def flush(self):
+        """ This function waits until every queued image is written. Write errors are printed and returned."""
+        self.__queue.join()
+        with self.__lock:
+            errors, self.__errors = self.__errors, []
+        for e in errors:
+            print(f"Artifact Writer Exception: {e}")
+        return errors
+
+    def close(self):
+        """ This function flushes the queue and stops the worker threads."""
+        errors = self.flush()
+        for _ in self.__workers:
+            self.__queue.put(None)
+        for worker in self.__workers:
+            worker.join()
+        self.__workers = []
+        return errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def save_image(path, img, writer = None):
+    """ This function saves an image to path (without extension), through the writer if one is given, otherwise synchronously as png."""
+    if writer is not None:
+        return writer.write(path, img)
+    cv2.imwrite(path + ".png", img)
+    return path + ".png"
+
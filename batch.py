@@ -0,0 +1,144 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+# Headless batch re-analysis of archived runs.
+#
+#   python batch.py "./Yosemite_Area_Imager/*/Original_Images" --wells 5 --processes 4
+#
+# Every run (an Original_Images directory, or the run directory holding one) is post processed with its results written to
+# the run directory as Batch_Yosemite_Area_Imager_*. Frames are checkpointed in the results log as they are analyzed, so running
+# the same command again after an interruption skips the finished runs and continues the unfinished ones where they stopped.
+
+import argparse
+import glob
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from mask_cache import MaskCache
+from pipeline import Pipeline, RESULTS_LOG_FILENAME, RUN_REPORT_FILENAME
+from results_db import ResultsStore
+from runs import ORIGINAL_IMAGES, run_images, run_directory
+
+logger = logging.getLogger(__name__)
+
+# result file prefix of the batch analysis, fixed so an interrupted batch finds its checkpoints
+RESULTS_PREFIX = "Batch_"
+
+
+def find_runs(patterns):
+    """ This function expands the directories and globs to the Original_Images directories of the runs, without duplicates, in order."""
+    runs = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if os.path.isdir(os.path.join(path, ORIGINAL_IMAGES)):
+                path = os.path.join(path, ORIGINAL_IMAGES)
+            path = os.path.normpath(path)
+            if os.path.isdir(path) and path not in runs:
+                runs.append(path)
+            elif not os.path.isdir(path):
+                logger.warning(f"Not a run directory, skipping: {pattern}")
+    return runs
+
+
+def is_complete(images_directory):
+    """ This function checks whether a run was completely analyzed by an earlier batch (its run report is written last)."""
+    return os.path.exists(run_directory(images_directory) + RESULTS_PREFIX + RUN_REPORT_FILENAME)
+
+
+def analyze_run(images_directory, wells, options):
+    """ This function post processes one run, resuming from its checkpoint, and returns (run, frames analyzed, frames resumed, wall time)."""
+    directory = run_directory(images_directory)
+    images = run_images(images_directory)
+    assert images, f"No images in run: {images_directory}"
+
+    mask_cache = MaskCache(options["mask_cache"]) if options["mask_cache"] else None
+    results_store = ResultsStore(options["results_db"]) if options["results_db"] else None
+    pipeline = Pipeline(wells=wells, directory=directory, results_directory=directory, log_results=True, single_pass=options["single_pass"],
+                        mask_cache=mask_cache, save_debug_images=options["save_debug_images"], track_drift=options["track_drift"],
+                        excel=options["excel"], trace_memory=False, log_level=options["log_level"], min_well_size=options["min_well_size"],
+                        max_well_size=options["max_well_size"], results_prefix=RESULTS_PREFIX, resume=True, results_store=results_store)
+    try:
+        report = pipeline.run(images)
+    finally:
+        if results_store:
+            results_store.close()
+    return images_directory, report.get_count("analyzed"), report.get_count("resumed"), report.get_wall_time()
+
+
+def restart_run(images_directory):
+    """ This function removes the checkpoint and report of an earlier batch so the run is analyzed from the start."""
+    for filename in (RESULTS_LOG_FILENAME, RUN_REPORT_FILENAME):
+        path = run_directory(images_directory) + RESULTS_PREFIX + filename
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Re-analyse archived Yosemite area imager runs.")
+    parser.add_argument("runs", nargs="+", help="Original_Images directories, run directories or globs of them")
+    parser.add_argument("--wells", type=int, required=True, help="number of wells in every run")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(), help="runs analyzed at once (default: number of CPUs)")
+    parser.add_argument("--min-well-size", type=float, help="smallest well area in pixels (default: the Mask setting)")
+    parser.add_argument("--max-well-size", type=float, help="largest well area in pixels (default: the Mask setting)")
+    parser.add_argument("--single-pass", action="store_true", help="single pass well statistics (no pixel data in the workbook)")
+    parser.add_argument("--track-drift", action="store_true", help="register every frame against the mask image")
+    parser.add_argument("--mask-cache", help="directory of a mask cache shared by the runs")
+    parser.add_argument("--results-db", help="SQLite results store the runs are added to; frames it already holds are not analyzed again")
+    parser.add_argument("--no-excel", action="store_true", help="only write the results log, not the workbook")
+    parser.add_argument("--no-debug-images", action="store_true", help="skip the intermediate mask images")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoints of an earlier batch and analyze every run again")
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="console detail of each run")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format="%(message)s", level=logging.INFO)
+    runs = find_runs(args.runs)
+    if args.restart:
+        for run in runs:
+            restart_run(run)
+    pending = [run for run in runs if not is_complete(run)]
+    logger.info(f"Runs: {len(runs)} | Already Complete: {len(runs) - len(pending)} | To Analyze: {len(pending)}")
+
+    options = {"min_well_size": args.min_well_size, "max_well_size": args.max_well_size, "single_pass": args.single_pass, "track_drift": args.track_drift,
+               "mask_cache": args.mask_cache, "results_db": args.results_db, "excel": not args.no_excel, "save_debug_images": not args.no_debug_images, "log_level": getattr(logging, args.log_level)}
+
+    start = time.perf_counter()
+    analyzed = resumed = failed = 0
+    if pending:
+        # spawn (the only start method on Windows) so workers behave the same on every platform
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max(1, min(args.processes, len(pending))), mp_context=context) as pool:
+            futures = {pool.submit(analyze_run, run, args.wells, options): run for run in pending}
+            for future in as_completed(futures):
+                try:
+                    run, frames, skipped, wall_time = future.result()
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Run Failed: {futures[future]} | {type(e).__name__}: {e}")
+                    continue
+                analyzed += frames
+                resumed += skipped
+                logger.info(f"Run Complete: {run} | Frames Analyzed: {frames} | Frames Resumed: {skipped} | {wall_time:.1f} s")
+    elapsed = time.perf_counter() - start
+
+    logger.info(f"Batch Complete: {len(pending) - failed} of {len(pending)} runs | Failed: {failed} | Frames Analyzed: {analyzed} | Frames Resumed: {resumed} | "
+                f"{elapsed:.1f} s | Throughput: {analyzed / elapsed if elapsed > 0 else 0:.2f} frames/s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
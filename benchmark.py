@@ -0,0 +1,195 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+# Benchmark of the post processing hot paths on synthetic well plates (see synthetic.py).
+# Times and memory profiles Mask.getMasks, Image.analyze_img, Well.get_well_statistics and write_data,
+# and checks the well statistics against the ground truth of the synthetic frames. Runs headless, without the camera.
+#
+#   python benchmark.py --wells 5 96 384 --resolution 2000x1500 --frames 10 --drift 0.5 0.25
+#
+# The exit code is 1 if any ground truth check fails.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+import numpy as np
+from image import Mask, Image, CONTOURS, COMPONENTS
+from registration import Registration, shift_indices
+from export import write_data
+from pipeline import RunReport
+from synthetic import SyntheticPlate, LAYOUTS
+
+# ground truth tolerances
+IOU_TOLERANCE = 0.8         # minimum overlap of a segmented well with its drawn disc (the otsu edge is within about a pixel)
+CENTROID_TOLERANCE = 1.5    # pixels
+DRIFT_TOLERANCE = 1         # pixels per axis, the registration works on 4x downsampled frames
+LEVEL_TOLERANCE = 0.25      # well median from the drawn level, in noise sigmas (edge pixels pull it slightly)
+MEDIAN_TOLERANCE = 1        # well median from that of the drawn disc pixels, in intensity levels
+
+
+def check(checks, name, passed, detail):
+    """ This function records a ground truth check and prints it if it failed."""
+    checks.append({"check": name, "passed": bool(passed), "detail": detail})
+    if not passed:
+        print(f"CHECK FAILED | {name} | {detail}")
+
+
+def benchmark_plate(plate, frames, repeat, backend, track_drift):
+    """ This function benchmarks the post processing of one synthetic plate and returns the RunReport and the ground truth checks."""
+    num_wells = plate.get_num_wells()
+    report = RunReport({"wells": num_wells, "resolution": list(plate.get_resolution()), "frames": frames, "noise": plate.get_noise(),
+                        "backend": backend, "track_drift": track_drift, "repeat": repeat})
+    report.set_count("images", frames)
+    report.set_count("wells", num_wells)
+    checks = []
+    images = plate.get_frames(frames)
+    mask_index = frames - 1
+
+    # segment the last frame, as the post processing does
+    for _ in range(repeat):
+        mask_img = Mask(images[mask_index], num_wells=num_wells, backend=backend)
+        mask_img.set_min_well_size(plate.get_well_area() * 0.5)
+        mask_img.set_max_well_size(plate.get_well_area() * 1.5)
+        with report.measure("getMasks"):
+            mask_img.getMasks()
+
+    # map the segmented wells to the plate wells and compare them with the drawn discs
+    centroids = [mask_img.get_well(w).get_centroid() for w in range(num_wells)]
+    plate_wells, distances = plate.match_wells(centroids, index=mask_index)
+    check(checks, "wells matched", len(set(plate_wells.tolist())) == num_wells, f"{len(set(plate_wells.tolist()))} of {num_wells} plate wells")
+    check(checks, "centroids", distances.max() <= CENTROID_TOLERANCE, f"max distance {distances.max():.3f} px")
+    discs = plate.get_labels(mask_index)
+    segmented = mask_img.get_labels()
+    iou = [np.sum((segmented == w + 1) & (discs == plate_wells[w] + 1)) / np.sum((segmented == w + 1) | (discs == plate_wells[w] + 1)) for w in range(num_wells)]
+    check(checks, "segmentation", min(iou) >= IOU_TOLERANCE, f"min IoU {min(iou):.4f}")
+
+    registration = None
+    if track_drift:
+        with report.measure("Registration"):
+            registration = Registration(mask_img.get_original_mask_img())
+
+    analyzed_images = []
+    for index, frame in enumerate(images):
+        mask_dx, mask_dy = plate.get_offset(mask_index)
+        frame_dx, frame_dy = plate.get_offset(index)
+        offset = (frame_dx - mask_dx, frame_dy - mask_dy)
+        if registration:
+            with report.measure("Registration.estimate"):
+                estimate = registration.estimate(frame.get_image())
+            drift_error = max(abs(estimate[0] - offset[0]), abs(estimate[1] - offset[1]))
+            check(checks, "drift", drift_error <= DRIFT_TOLERANCE, f"frame {index} estimated {estimate}, drawn {offset}")
+            # the wells are measured at the estimated drift, as the post processing does
+            offset = estimate
+
+        for _ in range(repeat):
+            with Image(frame, num_wells=num_wells) as analysis_img:
+                analysis_img.initialize_wells_from_mask(mask_img)
+                with report.measure("Image.analyze_img single_pass"):
+                    analysis_img.analyze_img(single_pass=True, offset=offset)
+
+        analysis_img = Image(frame, num_wells=num_wells)
+        analysis_img.initialize_wells_from_mask(mask_img)
+        with report.measure("Image.analyze_img"):
+            analysis_img.analyze_img(offset=offset)
+        # the statistics stage on its own, timed on the intensities each well gathered
+        with report.measure("Well.get_well_statistics"):
+            for w in range(num_wells):
+                analysis_img.get_well(w).get_well_statistics()
+
+        # the statistics must match those of the drawn well discs of the frame, up to the pixels the measured wells misplace
+        # (the otsu edge is about a pixel off the disc edge and the estimated drift may be a pixel off): the mean may move by
+        # the misplaced pixel fraction of the intensity range and the median by one level
+        truth = plate.get_ground_truth(index)
+        frame_discs = plate.get_labels(index).ravel()
+        mean_errors, median_errors = [], []
+        for w in range(num_wells):
+            well = analysis_img.get_well(w)
+            measured = frame_discs[shift_indices(mask_img.get_well(w).get_indices(), frame.get_image().shape, offset)]
+            inside = np.count_nonzero(measured == plate_wells[w] + 1)
+            misplaced = (len(measured) - inside) + (truth["count"][plate_wells[w]] - inside)
+            bound = misplaced / max(min(len(measured), truth["count"][plate_wells[w]]), 1) * 255
+            # a well measured outside the frame has NaN statistics and fails
+            mean_errors.append(np.nan_to_num(abs(well.get_mean() - truth["mean"][plate_wells[w]]) / (bound + 1e-9), nan=np.inf))
+            median_errors.append(np.nan_to_num(abs(well.get_median() - truth["median"][plate_wells[w]]), nan=np.inf))
+        check(checks, "means", max(mean_errors) <= 1, f"frame {index} max mean error {max(mean_errors):.3f} of the misplaced pixel bound")
+        check(checks, "medians", max(median_errors) <= MEDIAN_TOLERANCE, f"frame {index} max median error {max(median_errors):.3f}")
+
+        # and the well medians must recover the drawn well levels
+        medians = np.array([analysis_img.get_well(w).get_median() for w in range(num_wells)])
+        level_error = np.abs(medians - plate.get_levels()[plate_wells]).max()
+        check(checks, "levels", level_error <= LEVEL_TOLERANCE * plate.get_noise() + 0.5, f"frame {index} max median error {level_error:.3f}")
+
+        analysis_img.release(keep_pixels=True)
+        analyzed_images.append(analysis_img)
+
+    with tempfile.TemporaryDirectory() as directory:
+        with report.measure("write_data"):
+            write_data(analyzed_images, os.path.join(directory, "Benchmark_Analysis.xlsx"), num_wells)
+
+    report.finish()
+    return report, checks
+
+
+def print_report(report, checks):
+    config = report.get_config()
+    print(f"Wells: {config['wells']} | Resolution: {config['resolution'][0]} x {config['resolution'][1]} | Frames: {config['frames']} | Backend: {config['backend']}")
+    for stage in report.get_stages():
+        peak = stage.get_peak_memory()
+        print(f"  {stage.get_name():<30} calls {stage.get_calls():>5} | wall {1000 * stage.get_wall_time() / stage.get_calls():9.3f} ms/call | "
+              f"cpu {1000 * stage.get_cpu_time() / stage.get_calls():9.3f} ms/call | peak {peak / 1e6 if peak is not None else float('nan'):8.2f} MB")
+    print(f"  checks passed {sum(c['passed'] for c in checks)} of {len(checks)}")
+
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Benchmark the post processing hot paths on synthetic well plates.")
+    parser.add_argument("--wells", type=int, nargs="+", default=[1, 5, 20, 96, 384], choices=sorted(LAYOUTS))
+    parser.add_argument("--resolution", type=parse_resolution, default=(1200, 900), help="frame size as WIDTHxHEIGHT")
+    parser.add_argument("--frames", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=8.0, help="gaussian noise sigma in intensity levels")
+    parser.add_argument("--drift", type=float, nargs=2, default=(0.0, 0.0), metavar=("DX", "DY"), help="plate drift per frame in pixels")
+    parser.add_argument("--repeat", type=int, default=3, help="repeats of the segmentation and single pass analysis")
+    parser.add_argument("--backend", default=CONTOURS, choices=[CONTOURS, COMPONENTS])
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak memory measurement (it slows allocations down)")
+    parser.add_argument("--report", help="save the measurements and checks as JSON")
+    args = parser.parse_args(argv)
+
+    if not args.no_memory:
+        tracemalloc.start()
+
+    results = []
+    passed = True
+    for wells in args.wells:
+        plate = SyntheticPlate(resolution=args.resolution, wells=wells, noise=args.noise, drift=args.drift)
+        track_drift = any(args.drift)
+        report, checks = benchmark_plate(plate, frames=args.frames, repeat=args.repeat, backend=args.backend, track_drift=track_drift)
+        print_report(report, checks)
+        passed = passed and all(c["passed"] for c in checks)
+        results.append(dict(report.as_dict(), checks=checks))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
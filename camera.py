@@ -0,0 +1,425 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+# Camera backends for image_acquisition.
+#
+# image_acquisition only talks to the camera through a CameraBackend: the library is initialized and closed, the device is opened as
+# its remote nodemap and data stream, and the finished buffers are converted to numpy images. IDSPeakBackend (IDS_Peak_Image_Acq.py)
+# is the U3-356xXLE-M through the IDS peak libraries. SyntheticBackend and ReplayBackend are stand-ins that emulate the nodemap and data
+# stream calls image_acquisition makes (ROI, Gain, ExposureTime, AcquisitionFrameRate, triggers and the buffer queue), so the acquisition
+# and post processing can run and be timed without the camera, e.g. headless on Linux. Their clock can run faster than real time.
+# With TriggerMode Off an emulated camera free-runs: it streams frames at AcquisitionFrameRate into the queued buffers from a background thread,
+# timestamped on the sensor schedule. The streamed frames are rendered before AcquisitionStart, so the frames lost in a free run are
+# those the host did not queue a buffer for in time, not those the emulator was too slow to render.
+
+import collections
+import threading
+import time
+import cv2
+import numpy as np
+from datetime import datetime, timedelta
+from frame import to_grayscale
+from runs import run_images
+from synthetic import SyntheticPlate
+
+# emulated camera limits, those of the U3-356xXLE-M as the GUI uses them
+MIN_GAIN = 1.0
+MAX_GAIN = 9.5
+MIN_EXPOSURE = 28.0         # us
+MAX_EXPOSURE = 763108.0     # us
+MAX_FRAME_RATE = 60.0       # fps
+MIN_BUFFERS = 3
+FREE_RUN_FRAMES = 16        # frames rendered ahead of a free run and streamed in turn
+
+
+class CameraBackend:
+    """ The camera as image_acquisition uses it. speed runs the backend clock (now, time and sleep) that many times faster than real time,
+    which only emulated cameras support.
+    """
+    def __init__(self, speed = 1.0):
+        assert speed > 0, "Camera backend speed not valid, must be > 0"
+        self.__speed = speed
+        self.__started = datetime.now()
+        self.__start = time.perf_counter()
+
+    def get_speed(self):
+        return self.__speed
+
+    def time(self):
+        """ This function returns the backend clock in seconds (for measuring periods)."""
+        return (time.perf_counter() - self.__start) * self.__speed
+
+    def now(self):
+        """ This function returns the wall clock time of the backend clock (for the acquisition times)."""
+        return self.__started + timedelta(seconds=self.time())
+
+    def sleep(self, seconds):
+        """ This function sleeps for seconds of the backend clock (a negative time raises ValueError, as time.sleep does)."""
+        time.sleep(seconds / self.__speed)
+
+    def initialize(self):
+        pass
+
+    def close(self):
+        pass
+
+    def open_device(self, model):
+        """ This function opens the camera and returns its (remote nodemap, opened data stream), or None if there is no camera."""
+        raise NotImplementedError
+
+    def get_image(self, buffer):
+        """ This function returns the image of a finished buffer as a (height, width, channels) numpy view of the buffer memory."""
+        raise NotImplementedError
+
+
+class NodeError(Exception):
+    """ An emulated nodemap or data stream error, raised where the IDS peak library raises ids_peak.Exception."""
+
+
+class EmulatedNode:
+    """ A nodemap node: a value with limits, an enumeration (entries) or a command (on_execute)."""
+    def __init__(self, value = None, minimum = None, maximum = None, entries = None, on_execute = None, read_only = False):
+        self.__value = value
+        self.__minimum = minimum
+        self.__maximum = maximum
+        self.__entries = entries
+        self.__on_execute = on_execute
+        self.__read_only = read_only
+
+    def Value(self):
+        return self.__value() if callable(self.__value) else self.__value
+
+    def Minimum(self):
+        return self.__minimum() if callable(self.__minimum) else self.__minimum
+
+    def Maximum(self):
+        return self.__maximum() if callable(self.__maximum) else self.__maximum
+
+    def SetValue(self, value):
+        if self.__read_only:
+            raise NodeError("Node is not writable")
+        minimum, maximum = self.Minimum(), self.Maximum()
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            raise NodeError(f"Value {value} out of range [{minimum}, {maximum}]")
+        self.__value = value
+
+    def SetCurrentEntry(self, entry):
+        if self.__entries is None or entry not in self.__entries:
+            raise NodeError(f"Entry not valid: {entry}")
+        self.__value = entry
+
+    def Execute(self):
+        if self.__on_execute is None:
+            raise NodeError("Node is not a command")
+        self.__on_execute()
+
+
+class EmulatedBuffer:
+    """ An announced data stream buffer. A finished buffer holds the frame in memory that is overwritten when it is filled again,
+    as a camera buffer is, so images must be copied out before the buffer is queued.
+    """
+    def __init__(self, size):
+        self.__memory = np.zeros(size, dtype=np.uint8)
+        self.__width = 0
+        self.__height = 0
+        self.__ready = 0.0
+        self.__frame_id = 0
+
+    def fill(self, image, ready, frame_id):
+        height, width = image.shape
+        self.__memory[:height * width] = image.ravel()
+        self.__width = width
+        self.__height = height
+        self.__ready = ready
+        self.__frame_id = frame_id
+
+    def get_ready(self):
+        return self.__ready
+
+    def FrameID(self):
+        return self.__frame_id
+
+    def Timestamp_ns(self):
+        # the backend clock time the frame was finished
+        return int(self.__ready * 1e9)
+
+    def PixelFormat(self):
+        return "Mono8"
+
+    def BasePtr(self):
+        return self.__memory
+
+    def Size(self):
+        return self.__width * self.__height
+
+    def Width(self):
+        return self.__width
+
+    def Height(self):
+        return self.__height
+
+
+class EmulatedDataStream:
+    """ The data stream of an emulated camera: announced buffers are queued, filled by triggered frames and waited for in order.
+    A frame triggered while no buffer is queued is lost, as with the camera.
+    """
+    def __init__(self, camera):
+        self.__camera = camera
+        self.__announced = []
+        self.__queued = collections.deque()
+        self.__finished = collections.deque()
+        self.__condition = threading.Condition()
+        self.__started = False
+        self.__lost = 0
+
+    def get_lost_frames(self):
+        return self.__lost
+
+    def is_started(self):
+        return self.__started
+
+    def NumBuffersAnnouncedMinRequired(self):
+        return MIN_BUFFERS
+
+    def AllocAndAnnounceBuffer(self, size):
+        buffer = EmulatedBuffer(size)
+        self.__announced.append(buffer)
+        return buffer
+
+    def QueueBuffer(self, buffer):
+        if not any(buffer is announced for announced in self.__announced):
+            raise NodeError("Buffer was not announced")
+        with self.__condition:
+            self.__queued.append(buffer)
+
+    def StartAcquisition(self):
+        self.__started = True
+
+    def StopAcquisition(self):
+        self.__started = False
+
+    def deliver(self, image, ready, frame_id):
+        """ This function fills the next queued buffer with frame frame_id that is finished at backend time ready."""
+        with self.__condition:
+            if not self.__started or not self.__queued:
+                self.__lost += 1
+                return
+            buffer = self.__queued.popleft()
+            buffer.fill(image, ready, frame_id)
+            self.__finished.append(buffer)
+            self.__condition.notify_all()
+
+    def drop(self, count):
+        """ This function counts frames the camera finished but could not deliver as lost."""
+        with self.__condition:
+            self.__lost += count
+
+    def WaitForFinishedBuffer(self, timeout_ms):
+        deadline = time.perf_counter() + timeout_ms / 1000
+        with self.__condition:
+            while not self.__finished:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise NodeError("Wait for finished buffer timed out")
+                self.__condition.wait(remaining)
+            buffer = self.__finished.popleft()
+        # the frame is finished once it has been exposed
+        delay = buffer.get_ready() - self.__camera.time()
+        if delay > 0:
+            self.__camera.sleep(delay)
+        return buffer
+
+
+class EmulatedCamera(CameraBackend):
+    """ A camera that serves frames from get_frame_image(index) through an emulated nodemap and data stream.
+    The frames are cropped to the ROI (Width, Height, OffsetX, OffsetY) and a triggered frame is finished ExposureTime later on the backend clock.
+    With TriggerMode Off, AcquisitionStart starts streaming frames at AcquisitionFrameRate until AcquisitionStop.
+    Gain and ExposureTime are validated against the camera limits and recorded, they do not change the images.
+    """
+    MODEL = "Emulated"
+
+    def __init__(self, resolution, speed = 1.0):
+        super().__init__(speed=speed)
+        width, height = resolution
+        self.__triggered = 0
+        self.__acquiring = False
+        self.__data_stream = None
+        self.__stream = None
+        self.__ring = []
+        self.__stopped = threading.Event()
+        self.__nodes = {
+            "DeviceModelName": EmulatedNode(self.MODEL, read_only=True),
+            "DeviceUserID": EmulatedNode("", read_only=True),
+            "SensorName": EmulatedNode(type(self).__name__, read_only=True),
+            "WidthMax": EmulatedNode(width, read_only=True),
+            "HeightMax": EmulatedNode(height, read_only=True),
+            "Width": EmulatedNode(width, 1, lambda: width - self.get_value("OffsetX")),
+            "Height": EmulatedNode(height, 1, lambda: height - self.get_value("OffsetY")),
+            "OffsetX": EmulatedNode(0, 0, lambda: width - self.get_value("Width")),
+            "OffsetY": EmulatedNode(0, 0, lambda: height - self.get_value("Height")),
+            "PayloadSize": EmulatedNode(lambda: self.get_value("Width") * self.get_value("Height"), read_only=True),
+            "Gain": EmulatedNode(1.0, MIN_GAIN, MAX_GAIN),
+            "ExposureTime": EmulatedNode(10000.0, MIN_EXPOSURE, MAX_EXPOSURE),
+            "AcquisitionFrameRate": EmulatedNode(10.0, 0.1, lambda: min(MAX_FRAME_RATE, 1e6 / self.get_value("ExposureTime"))),
+            "TriggerSelector": EmulatedNode("ExposureStart", entries=["ExposureStart"]),
+            "TriggerMode": EmulatedNode("Off", entries=["On", "Off"]),
+            "TriggerSource": EmulatedNode("Software", entries=["Software", "Line0"]),
+            "TriggerSoftware": EmulatedNode(on_execute=self.trigger),
+            "AcquisitionStart": EmulatedNode(on_execute=self.start),
+            "AcquisitionStop": EmulatedNode(on_execute=self.stop),
+        }
+
+    def get_value(self, name):
+        return self.__nodes[name].Value()
+
+    def get_triggered(self):
+        return self.__triggered
+
+    def get_data_stream(self):
+        return self.__data_stream
+
+    def FindNode(self, name):
+        if name not in self.__nodes:
+            raise NodeError(f"Node not found: {name}")
+        return self.__nodes[name]
+
+    def get_frame_image(self, index):
+        """ This function returns the full sensor image of frame index (from 0) as a 2D uint8 array."""
+        raise NotImplementedError
+
+    def has_frame(self, index):
+        """ This function returns whether the camera has a frame index (from 0) to serve."""
+        return True
+
+    def get_roi_image(self, index):
+        x, y = self.get_value("OffsetX"), self.get_value("OffsetY")
+        return self.get_frame_image(index)[y:y + self.get_value("Height"), x:x + self.get_value("Width")]
+
+    def render_ring(self):
+        """ This function renders the next FREE_RUN_FRAMES frames (fewer at the end of the frames) cropped to the ROI, for a free run to stream."""
+        ring = []
+        for index in range(self.__triggered, self.__triggered + FREE_RUN_FRAMES):
+            if not self.has_frame(index):
+                break
+            ring.append(self.get_roi_image(index))
+        return ring
+
+    def start(self):
+        self.__acquiring = True
+        if self.get_value("TriggerMode") == "Off" and self.__stream is None:
+            # render the streamed frames before the sensor clock starts, rendering a frame can take longer than a frame period
+            self.__ring = self.render_ring()
+            self.__stopped.clear()
+            self.__stream = threading.Thread(target=self.free_run, name="EmulatedCamera", daemon=True)
+            self.__stream.start()
+
+    def stop(self):
+        self.__acquiring = False
+        if self.__stream is not None:
+            self.__stopped.set()
+            self.__stream.join()
+            self.__stream = None
+            self.__ring = []
+
+    def close(self):
+        self.stop()
+
+    def free_run(self):
+        """ This function streams frames into the data stream at the frame rate until the acquisition is stopped (TriggerMode Off).
+        Frame n is finished n + 1 frame periods after the start, on the sensor schedule, and shows the pre-rendered frame n of the ring (see
+        render_ring), which repeats after FREE_RUN_FRAMES frames. A frame is lost when no buffer is queued for it; should the stream itself fall
+        behind, the frames finished meanwhile are dropped, so they show as lost frames and FrameID gaps.
+        """
+        frame_period = 1 / self.get_value("AcquisitionFrameRate")
+        start = self.time()
+        first = self.__triggered
+        while not self.__stopped.is_set():
+            # frame n of the stream is frame first + n of the camera
+            frame = self.__triggered - first
+            exposing = max(frame, int((self.time() - start) / frame_period))
+            if exposing > frame:
+                self.__data_stream.drop(exposing - frame)
+                frame = exposing
+                self.__triggered = first + frame
+            if not self.has_frame(self.__triggered):
+                # e.g. the end of a replay that does not loop
+                break
+            image = self.__ring[frame % len(self.__ring)]
+            ready = start + (frame + 1) * frame_period
+            delay = ready - self.time()
+            if delay > 0 and self.__stopped.wait(delay / self.get_speed()):
+                break
+            self.__data_stream.deliver(image, ready, self.__triggered)
+            self.__triggered += 1
+
+    def trigger(self):
+        """ This function exposes the next frame into the data stream (a software trigger)."""
+        if not self.__acquiring or self.get_value("TriggerMode") != "On" or self.get_value("TriggerSource") != "Software":
+            raise NodeError("Software trigger not armed")
+        image = self.get_roi_image(self.__triggered)
+        self.__data_stream.deliver(image, self.time() + self.get_value("ExposureTime") / 1e6, self.__triggered)
+        self.__triggered += 1
+
+    def open_device(self, model):
+        print(f"Camera Backend: {type(self).__name__} | Speed: {self.get_speed()}x")
+        self.__data_stream = EmulatedDataStream(self)
+        return self, self.__data_stream
+
+    def get_image(self, buffer):
+        return buffer.BasePtr()[:buffer.Size()].reshape(buffer.Height(), buffer.Width(), 1)
+
+
+class SyntheticBackend(EmulatedCamera):
+    """ An emulated camera imaging a synthetic well plate (see synthetic.py); plate defaults to SyntheticPlate(**plate_options)."""
+    def __init__(self, plate = None, speed = 1.0, **plate_options):
+        self.__plate = plate if plate is not None else SyntheticPlate(**plate_options)
+        super().__init__(self.__plate.get_resolution(), speed=speed)
+
+    def get_plate(self):
+        return self.__plate
+
+    def get_frame_image(self, index):
+        return self.__plate.get_image(index)
+
+
+class ReplayBackend(EmulatedCamera):
+    """ An emulated camera replaying the frames of a saved run (an Original_Images directory of images or a frame stack) in acquisition order,
+    from the start again after the last frame if loop.
+    """
+    def __init__(self, directory, speed = 1.0, loop = True):
+        self.__images = run_images(directory)
+        assert self.__images, f"No images to replay in: {directory}"
+        self.__loop = loop
+        super().__init__(self.read(0).shape[::-1], speed=speed)
+
+    def get_num_frames(self):
+        return len(self.__images)
+
+    def has_frame(self, index):
+        return self.__loop or index < len(self.__images)
+
+    def read(self, index):
+        image = self.__images[index]
+        if isinstance(image, str):
+            decoded = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+            assert decoded is not None, f"Image could not be read: {image}"
+            return decoded
+        return np.asarray(to_grayscale(image.get_image()))
+
+    def get_frame_image(self, index):
+        if index >= len(self.__images):
+            if not self.__loop:
+                raise NodeError("No more frames to replay")
+            index %= len(self.__images)
+        return self.read(index)
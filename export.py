@@ -0,0 +1,80 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+from pixel_sidecar import get_sidecar_path, write_pixel_sidecar
+from results_log import read_results_log
+from kinetics import COLUMNS as KINETICS_COLUMNS
+from openpyxl import Workbook
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def write_data(imgs, analysis_filename, numberofwells, kinetics = None):
+    """This function writes the image acquisition data to an excel workbook with a sheet per well.
+    The workbook is streamed in openpyxl write only mode. The per well pixel intensities are written in full to a binary
+    sidecar next to it (see pixel_sidecar.py); each row's Pixel Offset and Pixel Count locate its pixels in the sidecar.
+    With kinetics (see kinetics.py) a Kinetics sheet of the per well kinetics and a Curves sheet of the well curves are added."""
+    # write the pixel sidecar first, so the rows can reference it
+    sidecar_path = get_sidecar_path(analysis_filename)
+    refs = write_pixel_sidecar(imgs, sidecar_path, numberofwells)
+    if refs is not None:
+        logger.info(f"Pixel Sidecar Saved: {sidecar_path}")
+
+    # create excel workbook to write data
+    wb = Workbook(write_only=True)
+
+    # create iteration for each well
+    for well_num in range(numberofwells):
+        ws = wb.create_sheet(f"Well {well_num}")
+
+        # write headers
+        ws.append(["Time of Image Creation", "Area", "Mean", "Stdev", "Median", "Minimum", "Maximum", "Mode",
+                   "Offset X", "Offset Y", "File Path", "Pixel Offset", "Pixel Count"])
+
+        # create new row for each image taken
+        for img_num, img in enumerate(imgs):
+            well = img.get_well(well_num)
+            offset_x, offset_y = img.get_offset()
+
+            # the single pass analysis does not gather per pixel intensities
+            pixel_offset, pixel_count = refs[well_num, img_num] if refs is not None else (-1, -1)
+            if pixel_count < 0:
+                pixel_offset, pixel_count = None, None
+
+            ws.append([img.get_time(), well.get_area(), well.get_mean(), well.get_stdev(), well.get_median(), well.get_min(),
+                       well.get_max(), well.get_mode()[0], offset_x, offset_y, img.get_file_path(), pixel_offset, pixel_count])
+
+    if kinetics is not None:
+        # one row per well of the kinetics over the run
+        ws = wb.create_sheet("Kinetics")
+        ws.append(KINETICS_COLUMNS)
+        for row in kinetics.get_rows():
+            ws.append(row)
+
+        # the well curves the kinetics were computed from, one row per image
+        ws = wb.create_sheet("Curves")
+        ws.append(["Time (s)"] + [f"Well {well_num}" for well_num in range(kinetics.get_num_wells())])
+        for row in kinetics.get_curve_rows():
+            ws.append(row)
+
+    # save the workbook
+    wb.save(analysis_filename)
+    logger.info(f"Workbook Saved: {analysis_filename}")
+
+def write_data_from_log(log_path, analysis_filename):
+    """This function converts a (possibly partial) results log to the excel workbook written by write_data. The log does not hold pixel data."""
+    imgs = read_results_log(log_path)
+    write_data(imgs, analysis_filename, imgs[0].get_num_wells() if imgs else 0)
+    return len(imgs)
@@ -0,0 +1,72 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import cv2
+import time
+from datetime import datetime
+
+# frame time format, free-run frames (several per second) add the milliseconds: '%Y-%m-%d_%H-%M-%S.%f'[:-3]
+TIME_FORMAT = '%Y-%m-%d_%H-%M-%S'
+
+
+def format_time(time, subsecond = False):
+    """ This function returns the frame time of a datetime, with the milliseconds if subsecond is set."""
+    if subsecond:
+        return time.strftime(TIME_FORMAT + '.%f')[:-3]
+    return time.strftime(TIME_FORMAT)
+
+
+def parse_time(text):
+    """ This function returns the datetime of a frame time, with or without the milliseconds."""
+    return datetime.strptime(text, TIME_FORMAT + '.%f' if '.' in text else TIME_FORMAT)
+
+
+def to_grayscale(img):
+    """ This function returns a 2D grayscale image, the same as cv2.imread(path, cv2.IMREAD_GRAYSCALE) gives for the saved file."""
+    if img.ndim == 2:
+        return img
+    if img.shape[2] == 1:
+        return img[:, :, 0]
+    if img.shape[2] == 4:
+        return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+class Frame:
+    """ A decoded acquisition frame with its metadata, handed from image_acquisition to post_processing so the saved file does not have to be read back.
+    The file path is where the frame was saved (None if it was not), and the time is in the same format Image and Mask use for files.
+    The source names a frame stored without a file of its own (e.g. a page of a run's frame stack) and is logged in place of the file path.
+    """
+    def __init__(self, image, path = None, acquired = None, index = None, source = None):
+        self.__image = to_grayscale(image)
+        self.__path = path
+        self.__time = acquired if acquired is not None else time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime())
+        self.__index = index
+        self.__source = source
+
+    def get_image(self):
+        return self.__image
+
+    def get_path(self):
+        return self.__path
+
+    def get_time(self):
+        return self.__time
+
+    def get_index(self):
+        return self.__index
+
+    def get_source(self):
+        """ This function returns the file path, or the source of a frame that was not saved as a file."""
+        return self.__path if self.__path is not None else self.__source
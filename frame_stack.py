@@ -0,0 +1,173 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+# Run storage as one raw frame stack instead of a PNG file per acquisition.
+#
+# <name>.npy  a standard NumPy array file of shape (capacity, height, width), allocated for the whole run and filled frame by frame
+# <name>.json the header: frame shape and dtype, the number of frames written, each frame's acquisition time and index, and the run metadata
+#
+# The header is replaced (atomically) after every frame, so its count always covers only complete frames, also after a crash.
+# Readers memory-map the array: a frame's pixels are read through the page cache when they are used, without decoding an image file,
+# so analysing the wells touches only the pages holding well pixels.
+
+import json
+import os
+import numpy as np
+from frame import Frame, to_grayscale
+
+STACK_FILENAME = "Frames.npy"
+STACK_VERSION = 1
+
+
+def get_header_path(path):
+    """ This function returns the path of the JSON header of a frame stack."""
+    return os.path.splitext(path)[0] + ".json"
+
+
+def is_frame_stack(path):
+    return isinstance(path, str) and path.endswith(".npy") and os.path.exists(get_header_path(path))
+
+
+def write_header(path, header):
+    """ This function replaces the header of a frame stack (written to a temporary file first, so a reader never sees half of it)."""
+    header_path = get_header_path(path)
+    with open(header_path + ".tmp", "w") as f:
+        json.dump(header, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(header_path + ".tmp", header_path)
+
+
+class FrameStackWriter:
+    """ Appends the frames of a run to a frame stack. capacity is the most frames the run will hold (the array is allocated up front,
+    unwritten frames take no disk space on file systems with sparse files). The frames are converted to grayscale as Image reads files.
+    metadata (e.g. gain, exposure and period) is saved in the header.
+    """
+    def __init__(self, path, shape, capacity, dtype = np.uint8, metadata = None):
+        assert capacity > 0, "Frame stack capacity not valid, must be > 0"
+        self.__path = path
+        self.__array = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(capacity, *shape))
+        self.__header = {
+            "version": STACK_VERSION,
+            "shape": list(shape),
+            "dtype": np.dtype(dtype).str,
+            "capacity": capacity,
+            "count": 0,
+            "metadata": metadata or {},
+            "frames": [],
+        }
+        write_header(path, self.__header)
+
+    def get_path(self):
+        return self.__path
+
+    def get_count(self):
+        return self.__header["count"]
+
+    def append(self, image, acquired = None, index = None):
+        """ This function writes the next frame to the stack and its header, and returns the frame's position in the stack."""
+        position = self.__header["count"]
+        assert position < self.__header["capacity"], "Frame stack full"
+        image = to_grayscale(image)
+        assert list(image.shape) == self.__header["shape"], f"Frame shape {image.shape} does not match the frame stack {self.__header['shape']}"
+        self.__array[position] = image
+
+        # the pixels reach the file before the header counts them
+        self.__array.flush()
+        self.__header["frames"].append({"acquired": acquired, "index": index})
+        self.__header["count"] = position + 1
+        write_header(self.__path, self.__header)
+        return position
+
+    def set_metadata(self, name, value):
+        """ This function adds an entry to the run metadata in the header (e.g. the acquisition schedule once the run is done)."""
+        self.__header["metadata"][name] = value
+        write_header(self.__path, self.__header)
+
+    def close(self):
+        if self.__array is not None:
+            self.__array.flush()
+            self.__array = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class FrameStack:
+    """ A memory-mapped frame stack (read only). Only the frames its header counts are visible."""
+    def __init__(self, path):
+        with open(get_header_path(path)) as f:
+            self.__header = json.load(f)
+        assert self.__header["version"] == STACK_VERSION, f"Frame stack version not supported: {self.__header['version']}"
+        self.__path = path
+        self.__array = np.load(path, mmap_mode="r")
+        assert list(self.__array.shape[1:]) == self.__header["shape"], "Frame stack does not match its header"
+
+    def get_path(self):
+        return self.__path
+
+    def get_count(self):
+        return self.__header["count"]
+
+    def __len__(self):
+        return self.get_count()
+
+    def get_metadata(self):
+        return self.__header["metadata"]
+
+    def get_image(self, position):
+        """ This function returns a memory-mapped view of a frame, its pixels are only read when they are used."""
+        assert 0 <= position < self.get_count(), "Frame stack position not valid"
+        return self.__array[position]
+
+    def get_frame(self, position):
+        frame = self.__header["frames"][position]
+        return StackFrame(self.__path, position, self.get_image(position), acquired=frame["acquired"], index=frame["index"])
+
+    def get_frames(self):
+        return [self.get_frame(position) for position in range(self.get_count())]
+
+
+# frame stacks opened by this process, so the frames sent to worker processes map each stack once per worker
+_stacks = {}
+
+
+def open_frame(path, position):
+    """ This function returns a frame of a stack, mapping the stack on first use in this process."""
+    stack = _stacks.get(path)
+    if stack is None or position >= stack.get_count():
+        stack = _stacks[path] = FrameStack(path)
+    return stack.get_frame(position)
+
+
+class StackFrame(Frame):
+    """ A frame of a frame stack: its image is a memory-mapped view and it pickles as its stack path and position,
+    so a process pool receives a reference to the frame instead of a copy of its pixels.
+    """
+    def __init__(self, stack_path, position, image, acquired = None, index = None):
+        super().__init__(image, acquired=acquired, index=index, source=f"{stack_path}[{position}]")
+        self.__stack_path = stack_path
+        self.__position = position
+
+    def get_stack_path(self):
+        return self.__stack_path
+
+    def get_position(self):
+        return self.__position
+
+    def __reduce__(self):
+        return (open_frame, (self.__stack_path, self.__position))
@@ -17,8 +17,12 @@
 
 import tkinter.messagebox
 import customtkinter
+import logging
+import multiprocessing
 from post_processing import *
 from IDS_Peak_Image_Acq import *
+from results_db import ResultsStore
+from scheduler import CATCH_UP, SKIP
 from datetime import datetime
 
 customtkinter.set_appearance_mode("System")  # Modes: "System" (standard), "Dark", "Light"
@@ -30,6 +34,11 @@ IMAGEPERIOD = 30        # Image Period
 IMAGEACQUISITIONS = 20  # Number of Acquisitions
 EXPOSURE_TIME = 763.108 # Exposure Time
 ANALOG_GAIN = 5.0       # Analog Gain
+FRAME_STACK = True      # Store a run as one memory-mapped frame stack instead of a PNG file per acquisition
+SCHEDULE_POLICY = CATCH_UP # A missed acquisition deadline is caught up (CATCH_UP) or skipped (SKIP), see scheduler.py
+FRAME_RATE = None       # None to trigger an acquisition every image period, or a free-run frame rate (fps) for a fast burst of acquisitions
+CAMERA_BACKEND = None   # None for the IDS camera, or a camera.py stand-in, e.g. SyntheticBackend(speed=10) (see load_test.py)
+RESULTS_DATABASE = None # SQLite results store of every run, e.g. "./Yosemite_Area_Imager/Yosemite_Area_Imager_Results.db" (None to disable)
 
 # Camera Values
 MIN_GAIN = 1
@@ -281,12 +290,18 @@ class App(customtkinter.CTk):
         self.progressbar_1.set(0)
         self.progressbar_1.start()
         self.progressbar_1.update_idletasks()
-        image_arr = image_acquisition(period=image_period, image_acquisitions=image_acquisitions, directory = ts + "Original_Images/", progressbar = self.progressbar_1, gain = gain, exposure_time=exposure)
+        image_arr = image_acquisition(period=image_period, image_acquisitions=image_acquisitions, directory = ts + "Original_Images/", progressbar = self.progressbar_1, gain = gain, exposure_time=exposure, return_frames = True, frame_stack = FRAME_STACK, backend = CAMERA_BACKEND, schedule_policy = SCHEDULE_POLICY, frame_rate = FRAME_RATE)
         self.progressbar_1.stop()
 
         # check that post processing has been toggled. If so, call post-processing function
         if post_processing_toggle:
-            post_processing(image_array=image_arr, wells=number_of_wells, logging = logging_toggle, directory = ts)
+            results_store = ResultsStore(RESULTS_DATABASE) if RESULTS_DATABASE else None
+            try:
+                post_processing(image_array=image_arr, wells=number_of_wells, logging = logging_toggle, directory = ts, results_store = results_store,
+                                run_metadata = {"gain": gain, "exposure": exposure, "period": 1 / FRAME_RATE if FRAME_RATE else image_period})
+            finally:
+                if results_store:
+                    results_store.close()
 
             # Uncomment to test on already taken image
             # post_processing_test(logging_toggle)
@@ -298,5 +313,8 @@ class App(customtkinter.CTk):
 
 
 if __name__ == "__main__":
+    # needed for the post processing process pool in the frozen executable
+    multiprocessing.freeze_support()
+    logging.basicConfig(format="%(message)s")
     app = App()
     app.mainloop()
\ No newline at end of file
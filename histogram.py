@@ -0,0 +1,150 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import math
+import numpy as np
+from collections import namedtuple
+
+# matches the (mode, count) layout of scipy.stats.mode so existing callers can keep using mode[0]
+ModeResult = namedtuple('ModeResult', ['mode', 'count'])
+
+HistogramStatistics = namedtuple('HistogramStatistics', ['count', 'mean', 'stdev', 'median', 'mode', 'minimum', 'maximum'])
+
+
+def intensity_histogram(int_array, levels=0):
+    """ This function bins integer pixel intensities into a histogram with one bin per intensity level (256 for 8-bit, 4096 for 12-bit).
+    If levels is 0 the histogram is sized to the largest intensity found.
+    """
+    int_array = np.asarray(int_array)
+    assert np.issubdtype(int_array.dtype, np.integer), "Histogram statistics require integer pixel intensities"
+    return np.bincount(int_array.ravel(), minlength=levels)
+
+
+def labelled_histograms(labels, img, num_labels, levels=0, region=None):
+    """ This function computes the intensity histogram of every labelled region in one pass over the frame.
+    Each pixel is keyed by (label, intensity) and counted with a single bincount, so the cost does not grow with the number of wells.
+    region is an optional (rows, cols) slice holding every label (e.g. the union of the well bounding boxes), only it is keyed and counted.
+    Row n - 1 of the result is the histogram of label n; background (label 0) is dropped.
+    """
+    assert labels.shape == img.shape, "Label image and image sizes do not match"
+    assert np.issubdtype(img.dtype, np.integer), "Histogram statistics require integer pixel intensities"
+    if region is not None:
+        labels = labels[region]
+        img = img[region]
+    levels = max(levels, int(img.max()) + 1 if img.size else 1)
+    assert (num_labels + 1) * levels < 2**32, "Too many labels and intensity levels for the histogram keys"
+    keys = labels.astype(np.uint32) * np.uint32(levels) + img
+    hists = np.bincount(keys.ravel(), minlength=(num_labels + 1) * levels)
+    return hists.reshape(num_labels + 1, levels)[1:]
+
+
+def histogram_accumulators(hists):
+    """ This function returns the count, sum, sum of squares, minimum and maximum of every histogram row as arrays."""
+    hists = np.asarray(hists, dtype=np.int64)
+    levels = np.arange(hists.shape[1], dtype=np.int64)
+    count = hists.sum(axis=1)
+    total = hists @ levels
+    total_squares = hists @ (levels * levels)
+    occupied = hists > 0
+    minimum = np.where(count > 0, np.argmax(occupied, axis=1), 0)
+    maximum = np.where(count > 0, hists.shape[1] - 1 - np.argmax(occupied[:, ::-1], axis=1), 0)
+    return count, total, total_squares, minimum, maximum
+
+
+def histogram_order_statistic(hist, k, cumulative=None):
+    """ This function returns the k-th smallest intensity (0 based) held in the histogram."""
+    if cumulative is None:
+        cumulative = np.cumsum(hist)
+    return int(np.searchsorted(cumulative, k, side='right'))
+
+
+def histogram_percentile(hist, q, cumulative=None):
+    """ This function returns the q-th percentile of the histogram using the same linear interpolation as np.percentile."""
+    if cumulative is None:
+        cumulative = np.cumsum(hist)
+    count = int(cumulative[-1])
+    assert count > 0, "Histogram is empty"
+    assert 0 <= q <= 100, "Percentile must be between 0 and 100"
+
+    position = (count - 1) * q / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    lower_value = histogram_order_statistic(hist, lower, cumulative)
+    if upper == lower:
+        return np.float64(lower_value)
+    upper_value = histogram_order_statistic(hist, upper, cumulative)
+    if upper_value == lower_value:
+        return np.float64(lower_value)
+    return np.float64(lower_value + (upper_value - lower_value) * (position - lower))
+
+
+def histogram_statistics(hist, dtype=np.uint8):
+    """ This function derives the count, mean, stdev, median, mode, minimum and maximum from an intensity histogram in a single O(bins) pass.
+    The integer sums are accumulated exactly, so the results match np.mean, np.median, np.min, np.max and scipy.stats.mode on the raw pixels.
+    The stdev is the correctly rounded value and can differ from np.std in the last floating point digit.
+    An empty histogram (e.g. a well drifted out of the frame) gives NaN statistics.
+    """
+    hist = np.asarray(hist, dtype=np.int64)
+    if hist.sum() == 0:
+        return HistogramStatistics(0, np.nan, np.nan, np.nan, ModeResult(np.nan, np.int64(0)), np.nan, np.nan)
+    cumulative = np.cumsum(hist)
+
+    # exact integer sums, converted to python ints so the variance products cannot overflow
+    count, total, total_squares, minimum, maximum = (int(acc[0]) for acc in histogram_accumulators(hist[np.newaxis]))
+
+    mean = np.float64(total / count)
+    variance = (count * total_squares - total * total) / (count * count)
+    stdev = np.float64(math.sqrt(max(variance, 0.0)))
+
+    # the (lowest) most common intensity
+    scalar = np.dtype(dtype).type
+    mode_index = int(np.argmax(hist))
+    mode = ModeResult(scalar(mode_index), np.int64(hist[mode_index]))
+
+    median = histogram_percentile(hist, 50, cumulative)
+
+    return HistogramStatistics(count, mean, stdev, median, mode, scalar(minimum), scalar(maximum))
+
+
+def histograms_statistics(hists, dtype=np.uint8):
+    """ This function derives the statistics of every histogram row at once (see histogram_statistics, which gives the same results per row).
+    It returns a list of HistogramStatistics, with NaN statistics for the empty rows.
+    """
+    hists = np.asarray(hists, dtype=np.int64)
+    count, total, total_squares, minimum, maximum = histogram_accumulators(hists)
+    cumulative = np.cumsum(hists, axis=1)
+
+    scalar = np.dtype(dtype).type
+    modes = np.argmax(hists, axis=1)
+
+    # the median as np.percentile interpolates it: the k-th smallest intensity is the number of cumulative counts <= k
+    position = (count - 1) * 0.5
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    lower_value = (cumulative <= lower[:, np.newaxis]).sum(axis=1)
+    upper_value = (cumulative <= upper[:, np.newaxis]).sum(axis=1)
+    medians = lower_value + (upper_value - lower_value) * (position - lower)
+
+    stats = []
+    for row in range(hists.shape[0]):
+        n = int(count[row])
+        if n == 0:
+            stats.append(HistogramStatistics(0, np.nan, np.nan, np.nan, ModeResult(np.nan, np.int64(0)), np.nan, np.nan))
+            continue
+        # python ints so the variance products cannot overflow
+        t, t2 = int(total[row]), int(total_squares[row])
+        variance = (n * t2 - t * t) / (n * n)
+        stats.append(HistogramStatistics(n, np.float64(t / n), np.float64(math.sqrt(max(variance, 0.0))), np.float64(medians[row]),
+                                         ModeResult(scalar(modes[row]), np.int64(hists[row, modes[row]])), scalar(minimum[row]), scalar(maximum[row])))
+    return stats
@@ -0,0 +1,153 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import csv
+import numpy as np
+from frame import parse_time
+
+# kinetics table columns, one row per well
+COLUMNS = ["Well", "Baseline", "Final", "Peak", "Fold Change", "Peak Fold Change", "Slope (/s)", "Max Rate (/s)", "Time of Max Rate (s)",
+           "Threshold", "Time to Threshold (s)"]
+
+
+def frame_times(imgs):
+    """ This function returns the time of every analyzed image in seconds from the first image."""
+    times = [parse_time(img.get_time()) for img in imgs]
+    return np.array([(time - times[0]).total_seconds() for time in times], dtype=np.float64)
+
+
+def well_curves(imgs, statistic = "mean"):
+    """ This function returns the (frames, wells) array of a well statistic ("mean" or "median") of the analyzed images."""
+    assert statistic in ("mean", "median"), "Kinetics statistic not valid, must be mean or median"
+    getter = "get_mean" if statistic == "mean" else "get_median"
+    return np.array([[getattr(img.get_well(w), getter)() for w in range(img.get_num_wells())] for img in imgs], dtype=np.float64).reshape(len(imgs), -1)
+
+
+class Kinetics:
+    """ Per well kinetics of a run from its (frames, wells) well curves and the frame times (seconds), computed over all wells at once:
+    the baseline (mean of the first baseline_frames frames), final and peak values, the fold change of the final and peak values over the
+    baseline, the least squares slope over the run, the largest rate between consecutive frames and when it happened, and the time the curve
+    first reaches the threshold (linearly interpolated between frames, NaN if never). threshold is an intensity, or None for threshold_fold
+    times each well's baseline.
+    """
+    def __init__(self, times, curves, baseline_frames = 1, threshold_fold = 2.0, threshold = None):
+        times = np.asarray(times, dtype=np.float64)
+        curves = np.asarray(curves, dtype=np.float64)
+        assert curves.ndim == 2 and len(times) == curves.shape[0], "Kinetics needs a (frames, wells) curve array with a time per frame"
+        assert curves.shape[0] > 0, "Kinetics needs at least one frame"
+        assert baseline_frames >= 1, "Kinetics baseline needs at least one frame"
+        num_frames, num_wells = curves.shape
+        self.__times = times
+        self.__curves = curves
+
+        self.__baseline = curves[:min(baseline_frames, num_frames)].mean(axis=0)
+        self.__final = curves[-1]
+        self.__peak = curves.max(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            baseline = np.where(self.__baseline != 0, self.__baseline, np.nan)
+            self.__fold_change = self.__final / baseline
+            self.__peak_fold_change = self.__peak / baseline
+
+        # least squares slope of every well against the same centred times
+        centred = times - times.mean()
+        spread = np.dot(centred, centred)
+        self.__slope = centred @ (curves - curves.mean(axis=0)) / spread if spread > 0 else np.full(num_wells, np.nan)
+
+        # rate between consecutive frames, frames at the same time have no rate
+        if num_frames > 1:
+            steps = np.diff(times)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                rates = np.where(steps[:, None] > 0, np.diff(curves, axis=0) / steps[:, None], -np.inf)
+            fastest = rates.argmax(axis=0)
+            self.__max_rate = rates[fastest, np.arange(num_wells)]
+            self.__time_of_max_rate = (times[fastest] + times[fastest + 1]) / 2
+            no_rate = np.isneginf(self.__max_rate)
+            self.__max_rate[no_rate] = np.nan
+            self.__time_of_max_rate[no_rate] = np.nan
+        else:
+            self.__max_rate = np.full(num_wells, np.nan)
+            self.__time_of_max_rate = np.full(num_wells, np.nan)
+
+        # first frame at or above the threshold, interpolated from the frame before it
+        self.__threshold = np.full(num_wells, threshold, dtype=np.float64) if threshold is not None else self.__baseline * threshold_fold
+        above = curves >= self.__threshold
+        crossed = above.any(axis=0)
+        first = above.argmax(axis=0)
+        before = np.maximum(first - 1, 0)
+        wells = np.arange(num_wells)
+        y0, y1 = curves[before, wells], curves[first, wells]
+        t0, t1 = times[before], times[first]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fraction = np.where(y1 > y0, (self.__threshold - y0) / (y1 - y0), 1.0)
+        self.__time_to_threshold = np.where(crossed, np.where(first > 0, t0 + np.clip(fraction, 0, 1) * (t1 - t0), times[0]), np.nan)
+
+    def get_times(self):
+        return self.__times
+
+    def get_curves(self):
+        return self.__curves
+
+    def get_num_wells(self):
+        return self.__curves.shape[1]
+
+    def get_baseline(self):
+        return self.__baseline
+
+    def get_final(self):
+        return self.__final
+
+    def get_peak(self):
+        return self.__peak
+
+    def get_fold_change(self):
+        return self.__fold_change
+
+    def get_peak_fold_change(self):
+        return self.__peak_fold_change
+
+    def get_slope(self):
+        return self.__slope
+
+    def get_max_rate(self):
+        return self.__max_rate
+
+    def get_time_of_max_rate(self):
+        return self.__time_of_max_rate
+
+    def get_threshold(self):
+        return self.__threshold
+
+    def get_time_to_threshold(self):
+        return self.__time_to_threshold
+
+    def get_rows(self):
+        """ This function returns the kinetics table as rows of COLUMNS, one per well (NaN values as None)."""
+        table = np.column_stack((self.__baseline, self.__final, self.__peak, self.__fold_change, self.__peak_fold_change, self.__slope,
+                                 self.__max_rate, self.__time_of_max_rate, self.__threshold, self.__time_to_threshold))
+        return [[well] + [None if np.isnan(value) else float(value) for value in row] for well, row in enumerate(table)]
+
+    def get_curve_rows(self):
+        """ This function returns the well curves as rows of the frame time followed by the value of every well."""
+        return [[float(t)] + [float(value) for value in row] for t, row in zip(self.__times, self.__curves)]
+
+    def save(self, path):
+        """ This function writes the kinetics table as a CSV file."""
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(["" if value is None else value for value in row] for row in self.get_rows())
+
+    def print_all(self):
+        for row in self.get_rows():
+            print(" | ".join(f"{name}: {value}" for name, value in zip(COLUMNS, row)))
@@ -0,0 +1,94 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+# Load test of the full acquisition and post processing path without the camera (see camera.py).
+#
+#   python load_test.py --wells 96 --resolution 2000x1500 --frames 20 --period 30 --speed 30
+#   python load_test.py --wells 5 --frame-rate 20 --frames 60 --exposure 20000
+#   python load_test.py --replay "./Yosemite_Area_Imager/<run>/Original_Images" --wells 5 --frames 20 --period 5
+#
+# The synthetic camera images a synthetic well plate, the replay camera serves the frames of a saved run. --speed runs the camera clock
+# faster than real time, so a run of 20 frames 30 s apart takes 20 s at 30x. The results go to ./Load_Test/<timestamp>/.
+
+import argparse
+import logging
+import sys
+import time
+from datetime import datetime
+from camera import SyntheticBackend, ReplayBackend
+from IDS_Peak_Image_Acq import image_acquisition
+from pipeline import Pipeline
+from scheduler import POLICIES, CATCH_UP
+from synthetic import LAYOUTS
+
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Load test the acquisition and post processing with an emulated camera.")
+    parser.add_argument("--wells", type=int, default=5, help="wells of the plate (the synthetic plate supports %s)" % sorted(LAYOUTS))
+    parser.add_argument("--replay", help="replay the frames of a saved run instead of a synthetic plate")
+    parser.add_argument("--resolution", type=parse_resolution, default=(1200, 900), help="synthetic frame size as WIDTHxHEIGHT")
+    parser.add_argument("--noise", type=float, default=8.0, help="synthetic gaussian noise sigma in intensity levels")
+    parser.add_argument("--drift", type=float, nargs=2, default=(0.0, 0.0), metavar=("DX", "DY"), help="synthetic plate drift per frame in pixels")
+    parser.add_argument("--frames", type=int, default=10, help="image acquisitions")
+    parser.add_argument("--period", type=float, default=5, help="acquisition period in (camera clock) seconds")
+    parser.add_argument("--frame-rate", type=float, help="free-run the camera at this frame rate (fps) instead of triggering every period")
+    parser.add_argument("--ring-buffers", type=int, help="free-run buffer ring size (default one second of frames)")
+    parser.add_argument("--speed", type=float, default=1.0, help="camera clock speed up")
+    parser.add_argument("--schedule", choices=POLICIES, default=CATCH_UP, help="what to do with a missed acquisition deadline")
+    parser.add_argument("--gain", type=float, default=5.0)
+    parser.add_argument("--exposure", type=float, default=100000.0, help="exposure time in us")
+    parser.add_argument("--png", action="store_true", help="save a PNG per frame instead of the frame stack")
+    parser.add_argument("--processes", type=int, default=1, help="post processing processes")
+    parser.add_argument("--min-well-size", type=float, help="smallest well area in pixels (default: from the synthetic plate, else the Mask setting)")
+    parser.add_argument("--max-well-size", type=float, help="largest well area in pixels (default: from the synthetic plate, else the Mask setting)")
+    parser.add_argument("--track-drift", action="store_true", help="register every frame against the mask image")
+    parser.add_argument("--directory", default="./Load_Test/", help="directory the runs are written to")
+    args = parser.parse_args(argv)
+    logging.basicConfig(format="%(message)s")
+
+    min_well_size, max_well_size = args.min_well_size, args.max_well_size
+    if args.replay:
+        backend = ReplayBackend(args.replay, speed=args.speed)
+    else:
+        backend = SyntheticBackend(resolution=args.resolution, wells=args.wells, noise=args.noise, drift=args.drift, period=args.period, speed=args.speed)
+        area = backend.get_plate().get_well_area()
+        min_well_size = min_well_size if min_well_size is not None else area * 0.5
+        max_well_size = max_well_size if max_well_size is not None else area * 1.5
+
+    run = args.directory + datetime.now().strftime('%Y_%m_%d_%H-%M-%S/')
+    start = time.perf_counter()
+    image_arr = image_acquisition(period=args.period, image_acquisitions=args.frames, directory=run + "Original_Images/", gain=args.gain,
+                                  exposure_time=args.exposure, return_frames=True, frame_stack=not args.png, backend=backend,
+                                  schedule_policy=args.schedule, frame_rate=args.frame_rate, ring_buffers=args.ring_buffers)
+    acquisition_time = time.perf_counter() - start
+    lost = backend.get_data_stream().get_lost_frames() if backend.get_data_stream() else None
+    print(f"Acquisition: {len(image_arr)} of {args.frames} frames | {acquisition_time:.2f} s | Lost Frames: {lost}")
+    if len(image_arr) < args.frames:
+        return 1
+
+    pipeline = Pipeline(wells=args.wells, directory=run, results_directory=run, processes=args.processes, track_drift=args.track_drift,
+                        min_well_size=min_well_size, max_well_size=max_well_size, log_level=logging.INFO,
+                        run_metadata={"gain": args.gain, "exposure": args.exposure, "period": 1 / args.frame_rate if args.frame_rate else args.period})
+    report = pipeline.run(image_arr)
+    print(f"Post Processing: {report.get_count('images')} frames | {report.get_wall_time():.2f} s | Results: {run}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
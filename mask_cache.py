@@ -0,0 +1,144 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# bump when the stored layout or the segmentation algorithm changes so old entries stop matching
+CACHE_VERSION = 2
+
+
+def remove_entry(path):
+    """ This function removes a cache entry, which another process sharing the cache (e.g. batch.py workers) may already have removed."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class MaskCache:
+    """ On disk cache of computed Mask segmentations, so re-analysing an archived run skips the blur, otsu and well segmentation.
+    Entries are compressed .npz files keyed by a hash of the mask image bytes and every segmentation parameter.
+    """
+    def __init__(self, directory = "./Mask_Cache/", max_entries = 64, max_age = 30 * 24 * 60 * 60):
+        self.__directory = directory
+        self.__max_entries = max_entries
+        self.__max_age = max_age    # seconds since last use
+
+    def get_directory(self):
+        return self.__directory
+
+    def get_max_entries(self):
+        return self.__max_entries
+
+    def get_max_age(self):
+        return self.__max_age
+
+    def get_key(self, mask):
+        """ This function returns the cache key of a mask: a hash of the image content and the segmentation parameters."""
+        key = hashlib.sha256()
+        key.update(mask.get_content_hash().encode())
+        key.update(repr((CACHE_VERSION, mask.get_num_wells(), mask.get_backend(), mask.get_pyramid_level(), mask.get_blur_kernel(), mask.get_threshold_type(),
+                         mask.get_min_well_size(), mask.get_max_well_size())).encode())
+        return key.hexdigest()
+
+    def get_entry_path(self, mask):
+        return os.path.join(self.get_directory(), self.get_key(mask) + ".npz")
+
+    def load(self, mask):
+        """ This function restores the segmentation of the mask from the cache. It returns False on a cache miss."""
+        path = self.get_entry_path(mask)
+        if not os.path.exists(path):
+            return False
+
+        try:
+            with np.load(path) as entry:
+                contours = None
+                if entry["has_contours"]:
+                    points = np.split(entry["contour_points"], entry["contour_offsets"][1:-1])
+                    contours = [p.reshape(-1, 1, 2) for p in points]
+                indices = np.split(entry["indices"], entry["index_offsets"][1:-1])
+                mask.set_segmentation(labels=entry["labels"], areas=entry["areas"].tolist(), bboxes=[tuple(b) for b in entry["bboxes"].tolist()],
+                                      centroids=[tuple(c) for c in entry["centroids"].tolist()], contours=contours, indices=indices)
+        except Exception as e:
+            logger.warning(f"Mask cache entry could not be read, removing it: {e}")
+            remove_entry(path)
+            return False
+
+        # mark as recently used for eviction
+        os.utime(path)
+        return True
+
+    def save(self, mask):
+        """ This function stores the segmentation of the mask in the cache and evicts stale entries."""
+        os.makedirs(self.get_directory(), exist_ok=True)
+
+        wells = [mask.get_well(w) for w in range(mask.get_num_wells())]
+        contours = [well.get_contours(compute=False) for well in wells]
+        has_contours = all(c is not None for c in contours)
+        contour_points = np.concatenate([c.reshape(-1, 2) for c in contours]) if has_contours else np.zeros((0, 2), dtype=np.int32)
+        contour_offsets = np.cumsum([0] + [len(c) for c in contours]) if has_contours else np.zeros(1, dtype=np.int64)
+        indices = [well.get_indices() for well in wells]
+
+        # write to a temporary file of this save first so an interrupted save never leaves a corrupt entry behind,
+        # also when processes sharing the cache (e.g. batch.py workers) save the same entry at once
+        path = self.get_entry_path(mask)
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.get_directory())
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, labels=mask.get_labels(),
+                                    areas=np.array([well.get_area() for well in wells], dtype=np.float64),
+                                    bboxes=np.array([well.get_bbox() for well in wells], dtype=np.int64).reshape(-1, 4),
+                                    centroids=np.array([well.get_centroid() for well in wells], dtype=np.float64).reshape(-1, 2),
+                                    has_contours=has_contours, contour_points=contour_points, contour_offsets=contour_offsets,
+                                    indices=np.concatenate(indices), index_offsets=np.cumsum([0] + [len(i) for i in indices]))
+            os.replace(temp_path, path)
+        except BaseException:
+            remove_entry(temp_path)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """ This function removes entries unused for longer than max_age and the least recently used entries beyond max_entries."""
+        if not os.path.exists(self.get_directory()):
+            return
+        # another process sharing the cache may remove entries at the same time
+        entries = []
+        for f in os.listdir(self.get_directory()):
+            if f.endswith(".npz"):
+                path = os.path.join(self.get_directory(), f)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except FileNotFoundError:
+                    continue
+        entries.sort(reverse=True)
+        now = time.time()
+        for index, (mtime, path) in enumerate(entries):
+            if index >= self.get_max_entries() or now - mtime > self.get_max_age():
+                remove_entry(path)
+
+    def clear(self):
+        """ This function removes every cache entry."""
+        if not os.path.exists(self.get_directory()):
+            return
+        for f in os.listdir(self.get_directory()):
+            if f.endswith(".npz"):
+                remove_entry(os.path.join(self.get_directory(), f))
@@ -0,0 +1,136 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from image import Mask, Image
+from registration import Registration
+
+
+class SharedMask:
+    """ Publishes a segmented Mask once through shared memory: the label image and the concatenated well indices.
+    Worker processes attach to the blocks instead of receiving a pickled copy of the mask with every task.
+    """
+    def __init__(self, mask):
+        labels = mask.get_labels()
+        wells = [mask.get_well(w) for w in range(mask.get_num_wells())]
+        indices = [well.get_indices() for well in wells]
+        all_indices = np.concatenate(indices).astype(np.int64)
+
+        self.__labels_block = self.publish(labels)
+        self.__indices_block = self.publish(all_indices)
+        self.__spec = {
+            "source": mask.get_frame() or mask.get_file_path(),
+            "num_wells": mask.get_num_wells(),
+            "labels": (self.__labels_block.name, labels.shape, labels.dtype.str),
+            "indices": (self.__indices_block.name, all_indices.shape, all_indices.dtype.str),
+            "index_offsets": np.cumsum([0] + [len(i) for i in indices]),
+            "areas": [well.get_area() for well in wells],
+            "bboxes": [well.get_bbox() for well in wells],
+            "centroids": [well.get_centroid() for well in wells],
+            "contours": [well.get_contours(compute=False) for well in wells],
+        }
+
+    def publish(self, arr):
+        """ This function copies an array into a new shared memory block."""
+        block = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+        return block
+
+    def get_spec(self):
+        """ This function returns the small picklable description workers use to attach to the shared mask."""
+        return self.__spec
+
+    def close(self):
+        """ This function frees the shared memory blocks."""
+        for block in (self.__labels_block, self.__indices_block):
+            block.close()
+            block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach_mask(spec):
+    """ This function rebuilds a Mask in a worker process from the shared memory blocks without copying them.
+    It returns the mask and the attached blocks, which must stay referenced while the mask is used.
+    """
+    blocks = []
+    views = {}
+    for key in ("labels", "indices"):
+        name, shape, dtype = spec[key]
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        views[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+    offsets = spec["index_offsets"]
+    indices = [views["indices"][offsets[w]:offsets[w + 1]] for w in range(spec["num_wells"])]
+    contours = spec["contours"] if all(c is not None for c in spec["contours"]) else None
+
+    mask = Mask(spec["source"], num_wells=spec["num_wells"])
+    mask.set_segmentation(labels=views["labels"], areas=spec["areas"], bboxes=spec["bboxes"], centroids=spec["centroids"], contours=contours, indices=indices)
+    return mask, blocks
+
+
+# per worker process state, set once by initialize_worker
+_worker = {}
+
+
+def initialize_worker(spec, single_pass, keep_pixels, track_drift):
+    mask, blocks = attach_mask(spec)
+    _worker["mask"] = mask
+    _worker["blocks"] = blocks
+    _worker["single_pass"] = single_pass
+    _worker["keep_pixels"] = keep_pixels
+    _worker["registration"] = Registration(mask.get_original_mask_img()) if track_drift else None
+
+
+def analyze_worker(img):
+    """ This function analyzes one image in a worker process and returns the released Image (only the well results are sent back)."""
+    mask = _worker["mask"]
+    registration = _worker["registration"]
+    with Image(img, num_wells=mask.get_num_wells()) as analysis_img:
+        analysis_img.initialize_wells_from_mask(mask)
+        offset = registration.estimate(analysis_img.get_image()) if registration else (0, 0)
+        analysis_img.analyze_img(single_pass=_worker["single_pass"], offset=offset)
+        analysis_img.release(keep_pixels=_worker["keep_pixels"])
+    return analysis_img
+
+
+def analyze_images_parallel(image_array, mask, processes = None, single_pass = False, keep_pixels = False, track_drift = False, on_result = None):
+    """ This function analyzes the images across a process pool and returns the released Images in acquisition order.
+    The mask is published once through shared memory; only the image paths (or frames) go to the workers and only the well results come back.
+    processes defaults to the number of CPUs. on_result is called with each released Image, in order, as soon as it is analyzed.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(image_array)))
+
+    with SharedMask(mask) as shared:
+        # spawn (the only start method on Windows) so workers behave the same on every platform
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=initialize_worker,
+                                 initargs=(shared.get_spec(), single_pass, keep_pixels, track_drift)) as pool:
+            chunksize = max(1, len(image_array) // (processes * 4))
+            analyzed_images = []
+            for analysis_img in pool.map(analyze_worker, image_array, chunksize=chunksize):
+                if on_result:
+                    on_result(analysis_img)
+                analyzed_images.append(analysis_img)
+            return analyzed_images
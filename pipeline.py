@@ -0,0 +1,470 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import time
+import tracemalloc
+from datetime import datetime
+from image import Mask, Image
+from frame import Frame
+from artifact_writer import ArtifactWriter
+from registration import Registration
+from parallel import analyze_images_parallel
+from results_log import ResultsLog, read_results_log
+from export import write_data
+from results_db import image_hash
+from kinetics import Kinetics, frame_times, well_curves
+from frame_stack import FrameStack, is_frame_stack
+from runs import run_directory
+
+logger = logging.getLogger(__name__)
+
+# output file names, prefixed with the run timestamp
+ANALYSIS_FILENAME = "Yosemite_Area_Imager_Analysis.xlsx"
+RESULTS_LOG_FILENAME = "Yosemite_Area_Imager_Results.csv"
+RUN_REPORT_FILENAME = "Yosemite_Area_Imager_Run_Report.json"
+PROFILE_FILENAME = "Yosemite_Area_Imager_Profile.prof"
+KINETICS_FILENAME = "Yosemite_Area_Imager_Kinetics.csv"
+
+
+def image_path(img):
+    """ This function returns the file path (or frame stack source) of an image_array entry (a path, a Frame or a numpy image), None if it has none."""
+    if isinstance(img, Frame):
+        return img.get_source()
+    return img if isinstance(img, str) else None
+
+
+def acquisition_run(image_array):
+    """ This function returns the acquisition run directory of the images (the parent of their Original_Images folder), None if they are not files."""
+    for img in image_array:
+        path = image_path(img)
+        if path is not None:
+            return os.path.normpath(run_directory(os.path.dirname(os.path.abspath(path))))
+    return None
+
+
+def resume_key(path):
+    """ This function returns the key a logged image is resumed by: its file name (with the position for a frame stack frame),
+    so a run directory that was moved or mounted elsewhere still resumes. None if the image has no path.
+    """
+    return os.path.basename(path) if path is not None else None
+
+
+# the loggers of the analysis modules, the entry points (batch.py, gui.py, load_test.py) configure the root logger and its handlers
+PACKAGE_LOGGERS = ("pipeline", "image", "well", "export", "mask_cache", "batch")
+
+
+def configure_logging(level):
+    """ This function sets the level of the analysis loggers (logging.DEBUG adds every contour and well), the root logger is left to the application."""
+    for name in PACKAGE_LOGGERS:
+        logging.getLogger(name).setLevel(level)
+
+
+class StageRecord:
+    """ Accumulated measurements of one pipeline stage over all of its calls."""
+    def __init__(self, name):
+        self.__name = name
+        self.__calls = 0
+        self.__wall_time = 0.0
+        self.__cpu_time = 0.0
+        self.__peak_memory = None
+
+    def get_name(self):
+        return self.__name
+
+    def get_calls(self):
+        return self.__calls
+
+    def get_wall_time(self):
+        return self.__wall_time
+
+    def get_cpu_time(self):
+        return self.__cpu_time
+
+    def get_peak_memory(self):
+        return self.__peak_memory
+
+    def add(self, wall_time, cpu_time, peak_memory):
+        self.__calls += 1
+        self.__wall_time += wall_time
+        self.__cpu_time += cpu_time
+        if peak_memory is not None:
+            self.__peak_memory = max(self.__peak_memory or 0, peak_memory)
+
+    def as_dict(self):
+        return {"calls": self.__calls, "wall_time": self.__wall_time, "cpu_time": self.__cpu_time, "peak_memory": self.__peak_memory}
+
+
+class RunReport:
+    """ Machine readable record of a pipeline run: the configuration, the output files and the wall time, CPU time and
+    peak memory of every stage. CPU time is for the whole process (background writer threads included) and peak memory is
+    the most memory allocated during a call of the stage beyond what was allocated when it started (None if memory was not traced).
+    """
+    def __init__(self, config):
+        self.__config = config
+        self.__started = datetime.now()
+        self.__start = time.perf_counter()
+        self.__wall_time = None
+        self.__stages = {}
+        self.__counts = {}
+        self.__outputs = {}
+
+    def get_config(self):
+        return self.__config
+
+    def get_stage(self, name):
+        return self.__stages.get(name)
+
+    def get_stages(self):
+        return list(self.__stages.values())
+
+    def get_count(self, name):
+        return self.__counts.get(name)
+
+    def get_output(self, name):
+        return self.__outputs.get(name)
+
+    def get_wall_time(self):
+        return self.__wall_time
+
+    def set_count(self, name, value):
+        self.__counts[name] = value
+
+    def set_output(self, name, path):
+        self.__outputs[name] = path
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        """ This function measures a block as a call of the named stage. Stages must not be nested (the memory peak is reset per stage)."""
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            start_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            peak = tracemalloc.get_traced_memory()[1] - start_memory if tracing else None
+            self.__stages.setdefault(name, StageRecord(name)).add(wall, cpu, peak)
+            logger.debug(f'Stage: {name} | Wall Time: {wall:.4f} s | CPU Time: {cpu:.4f} s | Peak Memory: {peak}')
+
+    def finish(self):
+        self.__wall_time = time.perf_counter() - self.__start
+
+    def as_dict(self):
+        images = self.__counts.get("images")
+        return {
+            "started": self.__started.isoformat(timespec="seconds"),
+            "wall_time": self.__wall_time,
+            "frames_per_second": images / self.__wall_time if images and self.__wall_time else None,
+            "config": self.__config,
+            "counts": self.__counts,
+            "outputs": self.__outputs,
+            "stages": {stage.get_name(): stage.as_dict() for stage in self.get_stages()},
+        }
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def print_all(self):
+        for stage in self.get_stages():
+            logger.info(f'Stage: {stage.get_name()} | Calls: {stage.get_calls()} | Wall Time: {stage.get_wall_time():.3f} s | CPU Time: {stage.get_cpu_time():.3f} s | Peak Memory: {stage.get_peak_memory()}')
+        logger.info(f'Total Wall Time: {self.__wall_time:.3f} s')
+
+
+class Pipeline:
+    """ The post processing of a run as a sequence of measured stages:
+    load and segment the mask image, combine the masks, save the mask images, then load and analyze each image and log its results,
+    and finally export the workbook and flush the mask images. Every stage is timed into a RunReport, which is saved as JSON next to the results.
+
+    results_directory is where the workbook, results log and run report go; None puts them in the mask image folder.
+    log_results writes the results log (and with excel the workbook). single_pass, mask_cache, image_format, compression, save_debug_images,
+    track_drift and processes are as for post_processing. trace_memory records the peak memory of each stage with tracemalloc,
+    profile also runs the whole pipeline under cProfile and saves the stats next to the report, and log_level sets the console detail
+    (logging.DEBUG prints every contour and well, None leaves the logging configuration alone).
+    min_well_size and max_well_size override the Mask well area limits (pixels).
+    results_prefix names the result files instead of the run timestamp. With resume (and log_results) the images already in
+    an existing results log of that name (matched by file name, so a moved run directory still resumes) are not analyzed again: their logged results are reused, so an interrupted run continues where it stopped.
+    results_store is a ResultsStore the run (named by its acquisition run directory, with the gain, exposure and period of run_metadata) and every
+    frame's well statistics are added to; a frame whose file hash is already stored, by this or an earlier run, is not analyzed again and its stored
+    results are used. The run is only added when it has a frame that was not stored yet.
+    kinetics computes the per well kinetics of the well mean curves over the run (see kinetics.py, kinetics_options are passed to Kinetics),
+    saved as a table next to the results log and as Kinetics and Curves sheets of the workbook.
+    """
+    def __init__(self, wells, directory = "./Images/", results_directory = None, log_results = True, single_pass = False, mask_cache = None,
+                 image_format = "png", compression = 1, save_debug_images = True, track_drift = False, processes = 1, excel = True,
+                 trace_memory = True, profile = False, log_level = logging.INFO, min_well_size = None, max_well_size = None, results_prefix = None, resume = False,
+                 results_store = None, run_metadata = None, kinetics = True, kinetics_options = None):
+        self.__wells = wells
+        self.__directory = directory
+        self.__results_directory = results_directory
+        self.__log_results = log_results
+        self.__single_pass = single_pass
+        self.__mask_cache = mask_cache
+        self.__image_format = image_format
+        self.__compression = compression
+        self.__save_debug_images = save_debug_images
+        self.__track_drift = track_drift
+        self.__processes = processes
+        self.__excel = excel
+        self.__trace_memory = trace_memory
+        self.__profile = profile
+        self.__log_level = log_level
+        self.__min_well_size = min_well_size
+        self.__max_well_size = max_well_size
+        self.__results_prefix = results_prefix
+        self.__resume = resume
+        self.__results_store = results_store
+        self.__run_metadata = run_metadata or {}
+        self.__kinetics = kinetics
+        self.__kinetics_options = kinetics_options or {}
+
+    def get_config(self):
+        """ This function returns the pipeline configuration as plain values for the run report."""
+        return {
+            "wells": self.__wells,
+            "directory": self.__directory,
+            "results_directory": self.__results_directory,
+            "log_results": self.__log_results,
+            "single_pass": self.__single_pass,
+            "mask_cache": self.__mask_cache.get_directory() if self.__mask_cache else None,
+            "image_format": self.__image_format,
+            "compression": self.__compression,
+            "save_debug_images": self.__save_debug_images,
+            "track_drift": self.__track_drift,
+            "processes": self.__processes,
+            "excel": self.__excel,
+            "trace_memory": self.__trace_memory,
+            "profile": self.__profile,
+            "min_well_size": self.__min_well_size,
+            "max_well_size": self.__max_well_size,
+            "results_prefix": self.__results_prefix,
+            "resume": self.__resume,
+            "results_store": self.__results_store.get_path() if self.__results_store else None,
+            "run_metadata": self.__run_metadata,
+            "kinetics": self.__kinetics,
+            "kinetics_options": self.__kinetics_options,
+        }
+
+    def run(self, image_array):
+        """ This function post processes the images, using the last image as the mask image (when all well samples should be positive).
+        image_array is a list of image paths, Frames or numpy images, or the path of a frame stack (which is memory-mapped). It returns the RunReport.
+        """
+        if is_frame_stack(image_array):
+            image_array = FrameStack(image_array).get_frames()
+        assert (len(image_array) > 0), "No Images Taken"
+        if self.__log_level is not None:
+            configure_logging(self.__log_level)
+
+        report = RunReport(self.get_config())
+        report.set_count("images", len(image_array))
+        report.set_count("wells", self.__wells)
+
+        started_tracing = self.__trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        profiler = cProfile.Profile() if self.__profile else None
+        if profiler:
+            profiler.enable()
+
+        try:
+            prefix = self.process(image_array, report)
+        finally:
+            if profiler:
+                profiler.disable()
+            if started_tracing:
+                tracemalloc.stop()
+        report.finish()
+
+        if profiler:
+            profiler.dump_stats(prefix + PROFILE_FILENAME)
+            report.set_output("profile", prefix + PROFILE_FILENAME)
+        report.set_output("run_report", prefix + RUN_REPORT_FILENAME)
+        report.save(prefix + RUN_REPORT_FILENAME)
+        report.print_all()
+        return report
+
+    def process(self, image_array, report):
+        """ This function runs the stages and returns the path prefix of the result files."""
+        wells = self.__wells
+        log_results = self.__log_results
+
+        # create the mask using the last image in array
+        mask_img = Mask(image_array[-1], num_wells=wells)
+        if self.__min_well_size is not None:
+            mask_img.set_min_well_size(self.__min_well_size)
+        if self.__max_well_size is not None:
+            mask_img.set_max_well_size(self.__max_well_size)
+        if self.__mask_cache is None:
+            # with a cache the image is only decoded on a cache miss, inside the segment stage
+            with report.measure("load"):
+                mask_img.get_original_mask_img()
+
+        # get the masks from the image
+        with report.measure("segment"):
+            mask_img.getMasks(cache=self.__mask_cache)
+        if logger.isEnabledFor(logging.DEBUG):
+            mask_img.print_all()
+
+        # combine all individual masks in a singular mask for show
+        with report.measure("combine"):
+            mask_img.combineMasks(show=False)
+
+        # save all created mask images in the background (the writer is closed also when a later stage fails, so the queued images are written)
+        with ArtifactWriter(image_format=self.__image_format, compression=self.__compression) as writer:
+            with report.measure("save"):
+                folder = mask_img.saveImages(directory=self.__directory, writer=writer, debug=self.__save_debug_images)
+            logger.info(f"Saving in Directory: {folder}")
+
+            # the result files share a timestamp (or the results_prefix) prefix
+            results_directory = self.__results_directory if self.__results_directory is not None else folder
+            prefix = results_directory + (self.__results_prefix if self.__results_prefix is not None else datetime.now().strftime('%Y_%m_%d_%H-%M_'))
+
+            # reuse the results of the images an earlier, interrupted run already logged
+            logged = {}
+            if log_results and self.__resume and os.path.exists(prefix + RESULTS_LOG_FILENAME):
+                logged = {resume_key(img.get_file_path()): img for img in read_results_log(prefix + RESULTS_LOG_FILENAME) if img.get_file_path() is not None}
+            pending = [index for index, img in enumerate(image_array) if resume_key(image_path(img)) not in logged]
+            report.set_count("resumed", len(image_array) - len(pending))
+            if logged:
+                logger.info(f"Resuming: {len(image_array) - len(pending)} of {len(image_array)} images already analyzed")
+
+            # reuse the stored results of the frames already in the results store
+            stored = {}
+            hashes = {}
+            store = self.__results_store
+            run_id = None
+            if store:
+                with report.measure("hash"):
+                    for index in pending:
+                        hashes[index] = image_hash(image_array[index])
+                        if store.has_frame(hashes[index]):
+                            stored[index] = store.load_image(hashes[index])
+                pending = [index for index in pending if index not in stored]
+                report.set_count("stored", len(stored))
+                report.set_output("results_store", store.get_path())
+                if stored:
+                    logger.info(f"Results Store: {len(stored)} of {len(image_array)} images already stored")
+            report.set_count("analyzed", len(pending))
+
+            # log each image's results as soon as they are computed, so a crash part way through keeps the analyzed images
+            results_log = ResultsLog(prefix + RESULTS_LOG_FILENAME) if log_results else None
+            if results_log:
+                report.set_output("results_log", results_log.get_path())
+            logging_order = sorted(stored)
+            pending_indices = iter(pending)
+
+            def log_stored(before):
+                # stored frames are logged too, in image order, so the log still covers the whole run
+                while logging_order and logging_order[0] < before:
+                    results_log.append(stored[logging_order.pop(0)])
+
+            def record(img):
+                # called with each analyzed image's results, in image order
+                nonlocal run_id
+                index = next(pending_indices)
+                if results_log:
+                    log_stored(index)
+                    results_log.append(img)
+                if store:
+                    # the run is named by its acquisition, and only added once it has a new frame, so a re-analysis does not add an empty run
+                    if run_id is None:
+                        run_id = store.add_run(acquisition_run(image_array) or prefix, wells, **self.__run_metadata)
+                    store.add_frame(run_id, index, img, hashes[index])
+
+            try:
+                analyzed = self.analyze([image_array[index] for index in pending], mask_img, record, report) if pending else []
+                if results_log:
+                    log_stored(len(image_array))
+            finally:
+                if results_log:
+                    results_log.close()
+            results = dict(stored)
+            results.update(zip(pending, analyzed))
+            analyzed_images = [logged[resume_key(image_path(img))] if resume_key(image_path(img)) in logged else results[index] for index, img in enumerate(image_array)]
+
+            # the kinetics of every well over the run, from the (images, wells) well means
+            kinetics = None
+            if log_results and self.__kinetics:
+                with report.measure("kinetics"):
+                    kinetics = Kinetics(frame_times(analyzed_images), well_curves(analyzed_images), **self.__kinetics_options)
+                    kinetics.save(prefix + KINETICS_FILENAME)
+                report.set_output("kinetics", prefix + KINETICS_FILENAME)
+                if logger.isEnabledFor(logging.DEBUG):
+                    kinetics.print_all()
+
+            if log_results and self.__excel:
+                # write data to excel sheet
+                with report.measure("export"):
+                    write_data(analyzed_images, prefix + ANALYSIS_FILENAME, wells, kinetics=kinetics)
+                report.set_output("excel", prefix + ANALYSIS_FILENAME)
+
+            # wait for the mask images to finish writing
+            with report.measure("flush"):
+                errors = writer.close()
+            report.set_count("artifact_errors", len(errors))
+        return prefix
+
+    def analyze(self, image_array, mask_img, record, report):
+        """ This function analyzes every image against the mask, passes each released Image to record (in order) and returns them in order."""
+        keep_pixels = self.__log_results and not self.__single_pass
+
+        # register every image against the mask image if the plate may drift during the run
+        registration = None
+        if self.__track_drift:
+            with report.measure("register"):
+                registration = Registration(mask_img.get_original_mask_img())
+
+        # analyze the images across a process pool, the mask is shared with the workers once
+        if self.__processes > 1:
+            with report.measure("analyze"):
+                return analyze_images_parallel(image_array, mask_img, processes=self.__processes, single_pass=self.__single_pass, keep_pixels=keep_pixels,
+                                               track_drift=self.__track_drift, on_result=record)
+
+        analyzed_images = []
+        for img in image_array:
+
+            # create Image class from image (closed at the end of the block)
+            with Image(img, num_wells=self.__wells) as analysis_img:
+                with report.measure("load"):
+                    analysis_img.load()
+
+                with report.measure("analyze"):
+                    # use the mask to isolate the individual wells
+                    analysis_img.initialize_wells_from_mask(mask_img)
+
+                    # estimate the drift of the image from the mask image
+                    offset = registration.estimate(analysis_img.get_image()) if registration else (0, 0)
+
+                    # analyze the image
+                    analysis_img.analyze_img(single_pass=self.__single_pass, offset=offset)
+
+                if logger.isEnabledFor(logging.DEBUG):
+                    analysis_img.print_all()
+
+                # keep only the well results (and the pixel intensities if they are logged)
+                analysis_img.release(keep_pixels=keep_pixels)
+
+            # log the image results
+            with report.measure("log"):
+                record(analysis_img)
+
+            analyzed_images.append(analysis_img)
+        return analyzed_images
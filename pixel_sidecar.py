@@ -0,0 +1,121 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import hashlib
+import os
+import numpy as np
+from registration import shift_indices
+
+
+def get_sidecar_path(analysis_filename):
+    """ This function returns the pixel sidecar file path that belongs to an analysis workbook."""
+    return os.path.splitext(analysis_filename)[0] + "_Pixels.npz"
+
+
+def write_pixel_sidecar(imgs, path, numberofwells):
+    """ This function writes the per well pixel intensities of every image to a binary .npz sidecar. It is not compressed:
+    zlib gains little on noisy raw intensities and took most of the post processing time.
+    The intensities of all (well, image) rows are concatenated, so each row is referenced by an (offset, count) pair.
+    The wells keep the shared mask indices and the (dx, dy) offset each image's pixels were gathered at, so the mask indices are stored
+    once per distinct index array, compared by content (also when the results are copies returned by worker processes), with one offset per row.
+    It returns a (wells, images, 2) array of the (offset, count) of each row, with count -1 where no pixels were kept,
+    or None (and no file) when no image kept pixels.
+    """
+    refs = np.full((numberofwells, len(imgs), 2), -1, dtype=np.int64)
+    index_ids = np.full((numberofwells, len(imgs)), -1, dtype=np.int64)
+    offsets = np.zeros((numberofwells, len(imgs), 2), dtype=np.int64)
+    shapes = np.zeros((len(imgs), 2), dtype=np.int64)
+    intensities = []
+    indices = []
+    index_numbers = {}
+    index_keys = {}
+    offset = 0
+
+    for well_num in range(numberofwells):
+        for img_num, img in enumerate(imgs):
+            well = img.get_well(well_num)
+            if well.get_intensities() is None:
+                continue
+            shapes[img_num] = well.get_shape()[:2]
+
+            # store each distinct index array once, hashing each array object once
+            well_indices = well.get_indices()
+            key = index_keys.get(id(well_indices))
+            if key is None:
+                key = index_keys[id(well_indices)] = (len(well_indices), hashlib.sha1(np.ascontiguousarray(well_indices)).hexdigest())
+            if key not in index_numbers:
+                index_numbers[key] = len(indices)
+                indices.append(well.get_indices())
+            index_ids[well_num, img_num] = index_numbers[key]
+            offsets[well_num, img_num] = well.get_pixel_offset()
+
+            count = len(well.get_intensities())
+            refs[well_num, img_num] = (offset, count)
+            intensities.append(well.get_intensities())
+            offset += count
+
+    if not intensities:
+        return None
+
+    # write to a temporary file first so an interrupted export never leaves a truncated sidecar behind
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        np.savez(f, intensities=np.concatenate(intensities), refs=refs, shapes=shapes, index_ids=index_ids, offsets=offsets,
+                            indices=np.concatenate(indices).astype(np.uint32), index_offsets=np.cumsum([0] + [len(i) for i in indices]))
+    os.replace(temp_path, path)
+    return refs
+
+
+class PixelSidecar:
+    """ Reader for the pixel sidecar written with the analysis workbook. The Pixel Offset and Pixel Count columns of
+    each well sheet locate a row's intensities; get_pixel_int_array rebuilds the [row, col, intensity] points.
+    """
+    def __init__(self, path):
+        with np.load(path) as sidecar:
+            self.__intensities = sidecar["intensities"]
+            self.__refs = sidecar["refs"]
+            self.__shapes = sidecar["shapes"]
+            self.__index_ids = sidecar["index_ids"]
+            # sidecars written before the offsets were stored hold the shifted indices themselves
+            self.__offsets = sidecar["offsets"] if "offsets" in sidecar else np.zeros(self.__refs.shape, dtype=np.int64)
+            index_offsets = sidecar["index_offsets"]
+            self.__indices = np.split(sidecar["indices"], index_offsets[1:-1])
+
+    def get_num_wells(self):
+        return self.__refs.shape[0]
+
+    def get_num_images(self):
+        return self.__refs.shape[1]
+
+    def get_intensities(self, image, well):
+        """ This function returns the pixel intensities of a well in an image (image number as in the workbook rows, from 0), or None if they were not kept."""
+        offset, count = self.__refs[well, image]
+        if count < 0:
+            return None
+        return self.__intensities[offset:offset + count]
+
+    def get_indices(self, image, well):
+        """ This function returns the flat pixel indices the intensities of a well in an image were gathered from."""
+        index_id = self.__index_ids[well, image]
+        if index_id < 0:
+            return None
+        return shift_indices(self.__indices[index_id], tuple(self.__shapes[image]), tuple(self.__offsets[well, image]))
+
+    def get_pixel_int_array(self, image, well):
+        """ This function returns the [row, col, intensity] points of a well in an image, the same as the analysed well gives."""
+        intensities = self.get_intensities(image, well)
+        if intensities is None:
+            return None
+        rows, cols = np.unravel_index(self.get_indices(image, well), tuple(self.__shapes[image]))
+        return np.column_stack((rows, cols, intensities))
@@ -0,0 +1,79 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import cv2
+import numpy as np
+
+
+class Registration:
+    """ Estimates how far each frame has drifted from the reference (mask) image by phase correlation on downsampled frames.
+    The offset (dx, dy) is the translation of the frame content: a well pixel at (row, col) in the reference is at (row + dy, col + dx) in the frame.
+    """
+    def __init__(self, reference, downsample = 4):
+        assert downsample >= 1, "Registration downsample factor not valid"
+        self.__downsample = downsample
+        self.__shape = reference.shape
+        reference = self.prepare(reference)
+        self.__window = cv2.createHanningWindow((reference.shape[1], reference.shape[0]), cv2.CV_32F)
+        # the window is applied here rather than passed to cv2.phaseCorrelate, which overwrites its first input when given a window
+        self.__reference = reference * self.__window
+
+    def get_downsample(self):
+        return self.__downsample
+
+    def prepare(self, img):
+        """ This function downsamples a frame to float32 for the phase correlation.
+        It is cropped to an even size the DFT does not pad: cv2.phaseCorrelate reports a half pixel shift between identical frames
+        when the transform size is odd.
+        """
+        size = (max(1, img.shape[1] // self.__downsample), max(1, img.shape[0] // self.__downsample))
+        small = cv2.resize(img, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+        return small[:even_dft_size(small.shape[0]), :even_dft_size(small.shape[1])]
+
+    def estimate(self, img):
+        """ This function returns the (dx, dy) offset of the frame from the reference in whole full resolution pixels."""
+        assert img.shape == self.__shape, "Frame and reference sizes do not match"
+        (dx, dy), response = cv2.phaseCorrelate(self.__reference, self.prepare(img) * self.__window)
+        return (int(round(dx * self.__downsample)), int(round(dy * self.__downsample)))
+
+
+def even_dft_size(n):
+    """ This function returns the largest even length up to n that cv2 transforms without padding."""
+    size = n
+    while size > 2 and (size % 2 or cv2.getOptimalDFTSize(size) != size):
+        size -= 1
+    return size if size > 2 else n
+
+
+def shift_indices(indices, shape, offset):
+    """ This function shifts flat (row-major) pixel indices by the (dx, dy) offset and drops the pixels that move out of the frame."""
+    dx, dy = offset
+    if dx == 0 and dy == 0:
+        return indices
+    rows, cols = np.divmod(indices, shape[1])
+    rows = rows + dy
+    cols = cols + dx
+    inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+    return rows[inside] * shape[1] + cols[inside]
+
+
+def overlap_slices(shape, offset):
+    """ This function returns the (reference, frame) slices of the region the reference and the frame shifted by (dx, dy) have in common.
+    reference[ref_slice] and frame[frame_slice] are the same scene points.
+    """
+    dx, dy = offset
+    height, width = shape
+    ref_slice = (slice(max(0, -dy), height - max(0, dy)), slice(max(0, -dx), width - max(0, dx)))
+    frame_slice = (slice(max(0, dy), height - max(0, -dy)), slice(max(0, dx), width - max(0, -dx)))
+    return ref_slice, frame_slice
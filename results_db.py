@@ -0,0 +1,229 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import hashlib
+import sqlite3
+import numpy as np
+from datetime import datetime, timedelta
+from frame import Frame, format_time, parse_time as parse_frame_time
+from histogram import ModeResult
+from results_log import LoggedImage
+from well import Well_Result
+
+# per well statistics stored for every frame (also the statistics the queries accept)
+STATISTICS = ("area", "mean", "stdev", "median", "minimum", "maximum", "mode")
+
+# well_stats is clustered by (well, time) (the frame time is repeated in it), so a well's series over a time range is one contiguous read
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    started INTEGER NOT NULL,
+    wells INTEGER NOT NULL,
+    gain REAL,
+    exposure REAL,
+    period REAL
+);
+CREATE TABLE IF NOT EXISTS frames (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    frame INTEGER NOT NULL,
+    time REAL NOT NULL,
+    file_path TEXT,
+    file_hash TEXT NOT NULL UNIQUE,
+    offset_x INTEGER,
+    offset_y INTEGER
+);
+CREATE TABLE IF NOT EXISTS well_stats (
+    well INTEGER NOT NULL,
+    time REAL NOT NULL,
+    frame_id INTEGER NOT NULL REFERENCES frames(id),
+    area REAL,
+    mean REAL,
+    stdev REAL,
+    median REAL,
+    minimum INTEGER,
+    maximum INTEGER,
+    mode INTEGER,
+    mode_count INTEGER,
+    PRIMARY KEY (well, time, frame_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS frames_run_time ON frames (run_id, time);
+CREATE INDEX IF NOT EXISTS well_stats_frame ON well_stats (frame_id);
+"""
+
+
+# times are stored as seconds since 1970 of the local wall clock time (as the image times are), with the milliseconds of free-run frames,
+# so they read back as datetime64 unchanged
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_seconds(time):
+    return (time - EPOCH) / timedelta(seconds=1)
+
+
+def from_seconds(seconds):
+    """ This function returns the datetime of stored seconds, rounded to the millisecond the image times have."""
+    return EPOCH + timedelta(milliseconds=round(seconds * 1000))
+
+
+def to_datetime64(seconds):
+    """ This function converts an array of stored seconds to datetime64[ms]."""
+    return np.rint(np.asarray(seconds, dtype=np.float64) * 1000).astype(np.int64).astype("datetime64[ms]")
+
+
+def to_query_seconds(time):
+    """ This function converts a query bound (datetime, numpy datetime64 or ISO string) to stored seconds."""
+    return int(np.datetime64(time, "ms").astype(np.int64)) / 1000
+
+
+def parse_time(image_time):
+    """ This function converts an image time ('%Y-%m-%d_%H-%M-%S', free-run frames also have milliseconds) to the seconds stored in the database."""
+    return to_seconds(parse_frame_time(image_time))
+
+
+def to_stored(value, kind = float):
+    """ This function converts a well statistic to the stored value: None (NULL) for the NaN statistics of a well without pixels."""
+    if value is None or np.isnan(value):
+        return None
+    return kind(value)
+
+
+def from_stored(value):
+    """ This function converts a stored well statistic back, NULL to NaN."""
+    return np.nan if value is None else value
+
+
+def image_hash(img):
+    """ This function returns the sha256 of an image_array entry: the file bytes for a path or a saved Frame, the pixels otherwise."""
+    content = hashlib.sha256()
+    if isinstance(img, np.ndarray):
+        img = Frame(img)
+    path = img.get_path() if isinstance(img, Frame) else img
+    if path is not None:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                content.update(block)
+    else:
+        content.update(repr(img.get_image().shape).encode())
+        content.update(np.ascontiguousarray(img.get_image()).tobytes())
+    return content.hexdigest()
+
+
+class ResultsStore:
+    """ Local SQLite database of the results of every run: run metadata (gain, exposure, period, well count), frame times and
+    file hashes, and per well statistics, indexed by run, well and time. A frame whose file hash is already stored is not analyzed again.
+    The query functions return NumPy arrays, with frame times as datetime64[ms].
+    """
+    def __init__(self, path):
+        self.__path = path
+        self.__connection = sqlite3.connect(path, timeout=60)
+        # write ahead logging lets batch workers write while others read
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        self.__connection.executescript(SCHEMA)
+        self.__connection.commit()
+
+    def get_path(self):
+        return self.__path
+
+    def add_run(self, name, wells, gain = None, exposure = None, period = None):
+        """ This function stores a run and returns its id. A run of the same name (e.g. a resumed or re-analysed acquisition) is reused."""
+        with self.__connection:
+            self.__connection.execute("INSERT OR IGNORE INTO runs (name, started, wells, gain, exposure, period) VALUES (?, ?, ?, ?, ?, ?)",
+                                      (name, int(to_seconds(datetime.now())), wells, gain, exposure, period))
+        return self.__connection.execute("SELECT id FROM runs WHERE name = ?", (name,)).fetchone()[0]
+
+    def has_frame(self, file_hash):
+        return self.__connection.execute("SELECT 1 FROM frames WHERE file_hash = ?", (file_hash,)).fetchone() is not None
+
+    def add_frame(self, run_id, frame, img, file_hash):
+        """ This function stores the well statistics of an analyzed (or released) Image in one transaction. A frame already stored is ignored."""
+        offset_x, offset_y = img.get_offset()
+        time = parse_time(img.get_time())
+        with self.__connection:
+            cursor = self.__connection.execute("INSERT OR IGNORE INTO frames (run_id, frame, time, file_path, file_hash, offset_x, offset_y) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                               (run_id, frame, time, img.get_file_path(), file_hash, offset_x, offset_y))
+            if cursor.rowcount == 0:
+                return
+            rows = []
+            for well_num in range(img.get_num_wells()):
+                well = img.get_well(well_num)
+                mode = well.get_mode()
+                rows.append((well_num, time, cursor.lastrowid, to_stored(well.get_area()), to_stored(well.get_mean()), to_stored(well.get_stdev()),
+                             to_stored(well.get_median()), to_stored(well.get_min(), int), to_stored(well.get_max(), int), to_stored(mode[0], int),
+                             to_stored(mode[1], int)))
+            self.__connection.executemany("INSERT INTO well_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def load_image(self, file_hash):
+        """ This function returns the stored results of a frame as a LoggedImage (as the results log reloads them), or None."""
+        frame = self.__connection.execute("SELECT id, frame, time, file_path, offset_x, offset_y FROM frames WHERE file_hash = ?", (file_hash,)).fetchone()
+        if frame is None:
+            return None
+        frame_id, number, time, file_path, offset_x, offset_y = frame
+        wells = [Well_Result(well=well, area=from_stored(area), mean=from_stored(mean), stdev=from_stored(stdev), median=from_stored(median),
+                             mode=ModeResult(from_stored(mode), mode_count), minimum=from_stored(minimum), maximum=from_stored(maximum))
+                 for well, area, mean, stdev, median, minimum, maximum, mode, mode_count in self.__connection.execute(
+                     "SELECT well, area, mean, stdev, median, minimum, maximum, mode, mode_count FROM well_stats WHERE frame_id = ? ORDER BY well", (frame_id,))]
+        time = from_seconds(time)
+        return LoggedImage(number, format_time(time, subsecond=time.microsecond != 0), file_path, (offset_x, offset_y), wells)
+
+    def query_runs(self):
+        """ This function returns every run as a structured array (id, name, started, wells, gain, exposure, period, frames)."""
+        rows = self.__connection.execute("SELECT r.id, r.name, r.started, r.wells, r.gain, r.exposure, r.period, COUNT(f.id) FROM runs r "
+                                         "LEFT JOIN frames f ON f.run_id = r.id GROUP BY r.id ORDER BY r.started").fetchall()
+        dtype = [("id", np.int64), ("name", object), ("started", "datetime64[s]"), ("wells", np.int64), ("gain", np.float64),
+                 ("exposure", np.float64), ("period", np.float64), ("frames", np.int64)]
+        return np.array([(i, n, np.datetime64(s, "s"), w, np.nan if g is None else g, np.nan if e is None else e, np.nan if p is None else p, f)
+                         for i, n, s, w, g, e, p, f in rows], dtype=dtype)
+
+    def query_well(self, well, statistic = "mean", run = None, start = None, end = None):
+        """ This function returns (times, values) of one well's statistic in time order, over one run or every run,
+        optionally limited to start <= time < end (datetime, numpy datetime64 or ISO strings).
+        """
+        assert statistic in STATISTICS, f"Statistic not valid, must be one of {STATISTICS}"
+        query = f"SELECT time, {statistic} FROM well_stats WHERE well = ?"
+        params = [well]
+        if run is not None:
+            query += " AND frame_id IN (SELECT id FROM frames WHERE run_id = ?)"
+            params.append(run)
+        if start is not None:
+            query += " AND time >= ?"
+            params.append(to_query_seconds(start))
+        if end is not None:
+            query += " AND time < ?"
+            params.append(to_query_seconds(end))
+        # frames stored in the same millisecond stay in acquisition order
+        data = np.array(self.__connection.execute(query + " ORDER BY time, frame_id", params).fetchall(), dtype=np.float64).reshape(-1, 2)
+        return to_datetime64(data[:, 0]), data[:, 1]
+
+    def query_run(self, run, statistic = "mean"):
+        """ This function returns (times, values) of a run: the frame times and a (frames, wells) array of the statistic."""
+        assert statistic in STATISTICS, f"Statistic not valid, must be one of {STATISTICS}"
+        wells = self.__connection.execute("SELECT wells FROM runs WHERE id = ?", (run,)).fetchone()[0]
+        rows = self.__connection.execute(f"SELECT f.time, w.well, w.{statistic} FROM frames f JOIN well_stats w ON w.frame_id = f.id "
+                                         "WHERE f.run_id = ? ORDER BY f.time, f.frame, w.well", (run,)).fetchall()
+        data = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        values = data[:, 2].reshape(-1, wells)
+        times = to_datetime64(data[::wells, 0])
+        return times, values
+
+    def close(self):
+        self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,170 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import csv
+import os
+from histogram import ModeResult
+from well import Well_Result
+
+# one row per frame and well, in this column order
+COLUMNS = ["Frame", "Well", "Time of Image Creation", "Area", "Mean", "Stdev", "Median", "Minimum", "Maximum", "Mode", "Mode Count",
+           "Offset X", "Offset Y", "File Path"]
+
+
+class ResultsLog:
+    """ Append only CSV log of the well statistics. Each analyzed frame is written (one row per well) and flushed to disk
+    as soon as its statistics are computed, so a crash part way through a run keeps every frame analyzed before it.
+    Opening an existing log appends to it and continues the frame numbering.
+    """
+    def __init__(self, path):
+        self.__path = path
+        self.__frames = 0
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new:
+            self.__frames = next_frame(path)
+        self.__file = open(path, "a", newline="")
+        self.__writer = csv.writer(self.__file)
+        if new:
+            self.__writer.writerow(COLUMNS)
+            self.flush()
+        elif not ends_with_newline(path):
+            # a crash cut the last row short, start the new rows on their own line
+            self.__file.write("\r\n")
+
+    def get_path(self):
+        return self.__path
+
+    def get_num_frames(self):
+        return self.__frames
+
+    def append(self, img):
+        """ This function writes the well statistics of an analyzed (or released) Image and flushes them to disk. It returns the frame number."""
+        frame = self.__frames
+        offset_x, offset_y = img.get_offset()
+        rows = []
+        for well_num in range(img.get_num_wells()):
+            well = img.get_well(well_num)
+            mode = well.get_mode()
+            rows.append([frame, well_num, img.get_time(), well.get_area(), well.get_mean(), well.get_stdev(), well.get_median(),
+                         well.get_min(), well.get_max(), mode[0], mode[1], offset_x, offset_y, img.get_file_path()])
+        self.__writer.writerows(rows)
+        self.flush()
+        self.__frames += 1
+        return frame
+
+    def flush(self):
+        """ This function pushes the written rows through to the disk."""
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    def close(self):
+        if not self.__file.closed:
+            self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class LoggedImage:
+    """ An analyzed frame reloaded from a results log. It has the getters write_data uses, with Well_Result records for the wells."""
+    def __init__(self, frame, time, file_path, offset, wells):
+        self.__frame = frame
+        self.__time = time
+        self.__file_path = file_path
+        self.__offset = offset
+        self.__wells = wells
+
+    def get_frame(self):
+        return self.__frame
+
+    def get_time(self):
+        return self.__time
+
+    def get_file_path(self):
+        return self.__file_path
+
+    def get_offset(self):
+        return self.__offset
+
+    def get_num_wells(self):
+        return len(self.__wells)
+
+    def get_well(self, well_num):
+        return self.__wells[well_num]
+
+
+def ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def next_frame(path):
+    """ This function returns the frame number after the last one in a results log (including a partially logged frame)."""
+    last = -1
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if row and row[0].isdigit():
+                last = max(last, int(row[0]))
+    return last + 1
+
+
+def parse_value(value, kind):
+    """ This function converts a logged value back to a number (None for an empty cell, NaN for the NaN statistics of a well without pixels)."""
+    if value == "":
+        return None
+    if value == "nan":
+        return float("nan")
+    return kind(value)
+
+
+def read_results_log(path):
+    """ This function reloads a (possibly partial) results log as a list of LoggedImage in frame order.
+    A last row cut short by a crash and a frame with missing wells are dropped, so a partial run reads back as the frames it completed.
+    """
+    with open(path, newline="") as f:
+        text = f.read()
+    # a last line without its line end was cut short by a crash
+    if not text.endswith("\n"):
+        text = text[:text.rfind("\n") + 1]
+
+    frames = {}
+    reader = csv.reader(text.splitlines())
+    header = next(reader, None)
+    if header is None:
+        return []
+    for row in reader:
+        if len(row) != len(COLUMNS):
+            continue
+        try:
+            frame, well_num = int(row[0]), int(row[1])
+            well = Well_Result(well=well_num, area=parse_value(row[3], float), mean=parse_value(row[4], float), stdev=parse_value(row[5], float),
+                               median=parse_value(row[6], float), mode=ModeResult(parse_value(row[9], int), parse_value(row[10], int)),
+                               minimum=parse_value(row[7], int), maximum=parse_value(row[8], int))
+            offset = (parse_value(row[11], int), parse_value(row[12], int))
+        except ValueError:
+            continue
+        frames.setdefault(frame, (row[2], row[13] or None, offset, {}))[3][well_num] = well
+
+    # keep only frames with every well logged
+    num_wells = max((len(wells) for _, _, _, wells in frames.values()), default=0)
+    images = []
+    for frame in sorted(frames):
+        time, file_path, offset, wells = frames[frame]
+        if len(wells) == num_wells and sorted(wells) == list(range(num_wells)):
+            images.append(LoggedImage(frame, time, file_path, offset, [wells[w] for w in range(num_wells)]))
+    return images
@@ -0,0 +1,44 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+
+# The layout of the saved runs: each acquisition writes its frames to <run>/Original_Images, as image files or as one frame stack.
+
+import os
+import re
+from frame_stack import FrameStack, STACK_FILENAME
+
+ORIGINAL_IMAGES = "Original_Images"
+IMAGE_EXTENSIONS = (".png", ".tif", ".tiff", ".bmp", ".jpg")
+
+
+def acquisition_key(path):
+    """ This function sorts the images of a run in acquisition order (the _Acq_<n> counter, then the name)."""
+    match = re.search(r"_Acq_(\d+)", os.path.basename(path))
+    return (int(match.group(1)) if match else -1, os.path.basename(path))
+
+
+def run_images(images_directory):
+    """ This function returns the image paths of a run in acquisition order, or the memory-mapped frames of a run stored as a frame stack."""
+    if os.path.exists(os.path.join(images_directory, STACK_FILENAME)):
+        return FrameStack(os.path.join(images_directory, STACK_FILENAME)).get_frames()
+    paths = [os.path.join(images_directory, f) for f in os.listdir(images_directory) if f.lower().endswith(IMAGE_EXTENSIONS)]
+    return sorted(paths, key=acquisition_key)
+
+
+def run_directory(images_directory):
+    """ This function returns the run directory the results are written to (the parent of Original_Images)."""
+    if os.path.basename(images_directory) == ORIGINAL_IMAGES:
+        return os.path.dirname(images_directory) + os.sep
+    return images_directory + os.sep
@@ -0,0 +1,104 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import math
+import time
+
+# what to do when an acquisition is later than its deadline
+CATCH_UP = "catch_up"   # acquire straight away, the following deadlines stay where they were (frames come back to back until on schedule)
+SKIP = "skip"           # drop the missed deadlines and wait for the next one still ahead
+POLICIES = (CATCH_UP, SKIP)
+
+
+class AcquisitionSchedule:
+    """ Deadline scheduler for the acquisition period. Deadline n is start + n * period on a monotonic clock, so a slow frame does not shift the
+    frames after it and the timing error does not accumulate. An acquisition more than tolerance seconds (default a tenth of the period) late has
+    missed its deadline and is handled by the policy (CATCH_UP or SKIP). Every acquisition's planned and actual time is recorded.
+    clock and sleep default to time.monotonic and time.sleep (a camera backend passes its own clock).
+    """
+    def __init__(self, period, policy = CATCH_UP, tolerance = None, clock = None, sleep = None):
+        assert period > 0, "Schedule period not valid, must be > 0"
+        assert policy in POLICIES, f"Schedule policy not valid, must be one of {POLICIES}"
+        self.__period = period
+        self.__policy = policy
+        self.__tolerance = tolerance if tolerance is not None else period / 10
+        self.__clock = clock if clock is not None else time.monotonic
+        self.__sleep = sleep if sleep is not None else time.sleep
+        self.__start = None
+        self.__slot = 0
+        self.__records = []
+
+    def get_period(self):
+        return self.__period
+
+    def get_policy(self):
+        return self.__policy
+
+    def get_records(self):
+        return self.__records
+
+    def start(self, at = None):
+        """ This function starts the schedule now (or at clock time at), the first deadline is immediate."""
+        self.__start = at if at is not None else self.__clock()
+        self.__slot = 0
+
+    def wait(self):
+        """ This function waits for the next deadline (as the policy says if it was missed), records the acquisition and returns its record."""
+        if self.__start is None:
+            self.start()
+        now = self.__clock()
+        planned = self.__start + self.__slot * self.__period
+        if now - planned > self.__tolerance and self.__policy == SKIP:
+            # move on to the first deadline still ahead
+            self.__slot = math.ceil((now - self.__start) / self.__period)
+            planned = self.__start + self.__slot * self.__period
+        if planned > now:
+            self.__sleep(planned - now)
+        return self.record(self.__clock())
+
+    def record(self, actual, slot = None):
+        """ This function records an acquisition at clock time actual for the next deadline (or deadline slot, e.g. of a camera timed frame)
+        without waiting, and returns its record."""
+        if slot is not None:
+            self.__slot = slot
+        planned = self.__start + self.__slot * self.__period
+        record = {
+            "frame": len(self.__records) + 1,
+            "slot": self.__slot,
+            "planned": planned - self.__start,
+            "actual": actual - self.__start,
+            "jitter": actual - planned,
+        }
+        self.__records.append(record)
+        self.__slot += 1
+        return record
+
+    def get_missed(self):
+        """ This function returns the deadlines missed so far: the skipped deadlines, or the late acquisitions when catching up."""
+        if self.__policy == SKIP:
+            return (self.__records[-1]["slot"] + 1 - len(self.__records)) if self.__records else 0
+        return sum(record["jitter"] > self.__tolerance for record in self.__records)
+
+    def as_dict(self):
+        """ This function returns the schedule and the per frame planned and actual times and jitter (seconds from the start) for the run metadata."""
+        jitter = [abs(record["jitter"]) for record in self.__records]
+        return {
+            "period": self.__period,
+            "policy": self.__policy,
+            "tolerance": self.__tolerance,
+            "missed": self.get_missed(),
+            "max_jitter": max(jitter) if jitter else None,
+            "mean_jitter": sum(jitter) / len(jitter) if jitter else None,
+            "frames": self.__records,
+        }
@@ -0,0 +1,144 @@
+# Note: This software is Reserved Product developed by Planet Innovation
+#
+# Copyright (c) 2024, Planet Innovation
+# 436 Elgar Rd, Box Hill, 3128, VIC, Australia
+# Phone: +61 3 9945 7510
+#
+# The copyright to the computer program(s) herein is the property of
+# Planet Innovation, Australia.
+# The program(s) may be used and/or copied only with the written permission
+# of Planet Innovation or in accordance with the terms and conditions
+# stipulated in the agreement/contract under which the program(s) have been
+# supplied.
+#
+
+import cv2
+import numpy as np
+from datetime import datetime, timedelta
+from frame import Frame
+
+# well plate layouts (rows, columns) by well count
+LAYOUTS = {
+    1: (1, 1),
+    5: (1, 5),
+    20: (4, 5),
+    96: (8, 12),
+    384: (16, 24),
+}
+
+
+class SyntheticPlate:
+    """ Generator of synthetic fluorescent well plate frames with known ground truth, for benchmarks and checks without the camera.
+    The wells are filled discs on a regular grid over a dark background, each with its own brightness, and every pixel gets gaussian noise.
+    Frame n is translated by round(n * drift) pixels, so the well positions of every frame are known exactly.
+    resolution is (width, height) and wells one of the LAYOUTS; well levels default to a ramp from 120 to 220 over the wells.
+    """
+    def __init__(self, resolution = (1200, 900), wells = 5, noise = 8.0, drift = (0.0, 0.0), background = 20.0, levels = None, well_fill = 0.7,
+                 period = 30, seed = 0):
+        assert wells in LAYOUTS, f"Synthetic plate well count not valid, must be one of {sorted(LAYOUTS)}"
+        assert 0 < well_fill < 1, "Synthetic well fill not valid, must be between 0 and 1"
+        self.__resolution = resolution
+        self.__wells = wells
+        self.__noise = noise
+        self.__drift = drift
+        self.__background = background
+        self.__levels = np.asarray(levels if levels is not None else np.linspace(120, 220, wells), dtype=np.float64)
+        assert len(self.__levels) == wells, "Synthetic plate needs one level per well"
+        self.__period = period      # seconds between frame times
+        self.__seed = seed
+        self.__start = datetime(2024, 1, 1, 9, 0, 0)
+
+        # well centres on a grid with half a pitch of margin, the disc diameter is well_fill of the pitch
+        rows, cols = LAYOUTS[wells]
+        width, height = resolution
+        pitch = min(width / cols, height / rows)
+        x0 = (width - pitch * cols) / 2 + pitch / 2
+        y0 = (height - pitch * rows) / 2 + pitch / 2
+        self.__centres = np.array([(x0 + c * pitch, y0 + r * pitch) for r in range(rows) for c in range(cols)])
+        self.__radius = max(2, int(pitch * well_fill / 2))
+
+    def get_resolution(self):
+        return self.__resolution
+
+    def get_num_wells(self):
+        return self.__wells
+
+    def get_noise(self):
+        return self.__noise
+
+    def get_levels(self):
+        return self.__levels
+
+    def get_radius(self):
+        return self.__radius
+
+    def get_well_area(self):
+        """ This function returns the nominal well area in pixels, for setting the Mask well size limits."""
+        return np.pi * self.__radius ** 2
+
+    def get_offset(self, index):
+        """ This function returns the whole pixel (dx, dy) drift of frame index from frame 0."""
+        return (int(round(index * self.__drift[0])), int(round(index * self.__drift[1])))
+
+    def get_centres(self, index = 0):
+        """ This function returns the (x, y) well centres in frame index."""
+        return np.rint(self.__centres) + self.get_offset(index)
+
+    def get_labels(self, index = 0):
+        """ This function returns the label image of frame index (0 is background, well n is n + 1)."""
+        width, height = self.__resolution
+        labels = np.zeros((height, width), dtype=np.uint16)
+        for well, (x, y) in enumerate(self.get_centres(index).astype(int)):
+            cv2.circle(labels, (int(x), int(y)), self.__radius, well + 1, thickness=-1)
+        return labels
+
+    def get_image(self, index = 0):
+        """ This function renders frame index as a uint8 grayscale image. The same index always gives the same image."""
+        labels = self.get_labels(index)
+        rng = np.random.default_rng((self.__seed, index))
+        img = np.concatenate(([self.__background], self.__levels))[labels]
+        img += rng.normal(0, self.__noise, labels.shape)
+        return np.clip(np.rint(img), 0, 255).astype(np.uint8)
+
+    def get_frame(self, index = 0):
+        """ This function returns frame index as a Frame, acquired period seconds after the previous frame."""
+        acquired = (self.__start + timedelta(seconds=index * self.__period)).strftime('%Y-%m-%d_%H-%M-%S')
+        return Frame(self.get_image(index), acquired=acquired, index=index)
+
+    def get_frames(self, count):
+        return [self.get_frame(index) for index in range(count)]
+
+    def write(self, directory, count):
+        """ This function saves count frames as png files in directory and returns the paths."""
+        paths = []
+        for index in range(count):
+            path = directory + f"Synthetic_Acq_{index + 1}.png"
+            cv2.imwrite(path, self.get_image(index))
+            paths.append(path)
+        return paths
+
+    def get_ground_truth(self, index = 0):
+        """ This function returns the exact statistics of the pixels inside every well disc of frame index:
+        a dict of arrays with the pixel count, mean, stdev, median, minimum and maximum of each well.
+        """
+        labels = self.get_labels(index).ravel()
+        img = self.get_image(index).ravel()
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(1, self.__wells + 2))
+        truth = {"count": [], "mean": [], "stdev": [], "median": [], "minimum": [], "maximum": []}
+        for well in range(self.__wells):
+            values = img[order[bounds[well]:bounds[well + 1]]]
+            truth["count"].append(len(values))
+            truth["mean"].append(values.mean())
+            truth["stdev"].append(values.std())
+            truth["median"].append(np.median(values))
+            truth["minimum"].append(values.min())
+            truth["maximum"].append(values.max())
+        return {key: np.array(value) for key, value in truth.items()}
+
+    def match_wells(self, centroids, index = 0):
+        """ This function maps segmented wells to plate wells: for each (x, y) centroid it returns the nearest well of frame index and the distance."""
+        centres = self.get_centres(index)
+        distances = np.linalg.norm(np.asarray(centroids, dtype=np.float64)[:, None, :] - centres[None, :, :], axis=2)
+        nearest = distances.argmin(axis=1)
+        return nearest, distances[np.arange(len(nearest)), nearest]
@@ -13,15 +13,32 @@
 #
 
 import cv2
+import logging
 import numpy as np
-from scipy import stats as st
+from histogram import intensity_histogram, histogram_statistics, histogram_percentile
+from registration import shift_indices
+
+logger = logging.getLogger(__name__)
+
+
+def crop_indices(pixels, x, y, width):
+    """ This function returns the flat (row-major) frame indices of the nonzero pixels of a crop at (x, y) of a frame width pixels wide.
+    The crop is searched once as a flat array and the crop row of each index is folded in, which is several times faster than np.nonzero on large wells.
+    """
+    crop_width = pixels.shape[1]
+    flat = np.flatnonzero(pixels)
+    return flat + (flat // crop_width) * (width - crop_width) + (y * width + x)
+
 
 class Well_Mask:
-    def __init__(self, well, contours=None, area=None, mask=None):
+    def __init__(self, well, contours=None, area=None, labels=None, bbox=None, indices=None, centroid=None):
         self.__well_num = well
         self.__contours = contours  
         self.__area = area
-        self.__mask = mask
+        self.__labels = labels
+        self.__bbox = bbox
+        self.__indices = indices
+        self.__centroid = centroid
 
     def set_contours(self, contours):
         self.__contours = contours
@@ -29,33 +46,89 @@ class Well_Mask:
     def set_area(self, area):
         self.__area = area
 
-    def set_mask(self, mask):
-        self.__mask = mask
+    def set_labels(self, labels):
+        self.__labels = labels
+
+    def set_bbox(self, bbox):
+        self.__bbox = bbox
+
+    def set_indices(self, indices):
+        self.__indices = indices
+
+    def set_centroid(self, centroid):
+        self.__centroid = centroid
     
-    def get_contours(self):
+    def get_contours(self, compute=True):
+        # the connected component backend does not trace contours, so they are traced from the label image when first asked for
+        if self.__contours is None and compute and self.__labels is not None:
+            self.compute_contours()
         return self.__contours
     
     def get_well_num(self):
         return self.__well_num
+
+    def get_label(self):
+        # label 0 is background in the label image, so well n is stored as n + 1
+        return self.__well_num + 1
     
     def get_area(self):
         return self.__area
+
+    def get_labels(self):
+        return self.__labels
+
+    def get_bbox(self):
+        return self.__bbox
     
     def get_mask(self):
-        return self.__mask
+        """ This function derives the full frame uint8 mask of the well from the shared label image on demand."""
+        WHITE = 255
+        labels = self.get_labels()
+        mask = np.zeros(labels.shape, dtype='uint8')
+        x, y, w, h = self.get_bbox()
+        mask[y:y+h, x:x+w][labels[y:y+h, x:x+w] == self.get_label()] = WHITE
+        return mask
+
+    def get_indices(self):
+        return self.__indices
+
+    def get_centroid(self):
+        return self.__centroid
     
     def print_all(self):
         well_num = self.get_well_num()
         contours = self.get_contours()
         area = self.get_area()
-        mask = self.get_mask()
+        labels = self.get_labels()
+        bbox = self.get_bbox()
+
+        print(f'Well Num: {well_num} | Area: {area}  | Contours: {contours.shape} | Mask: {labels.shape[1], labels.shape[0]} | Bounding Box: {bbox}')
 
-        print(f'Well Num: {well_num} | Area: {area}  | Contours: {contours.shape} | Mask: {mask.shape[1], mask.shape[0]}')
+    def compute_indices(self):
+        """ This function computes the flat (row-major) indices of the well pixels from the label image, searching only inside the well bounding box.
+        The mask does not change during a run, so the indices are computed once and reused for every image.
+        """
+        labels = self.get_labels()
+        x, y, w, h = self.get_bbox()
+        rows, cols = np.nonzero(labels[y:y+h, x:x+w] == self.get_label())
+        self.set_indices((rows + y) * labels.shape[1] + (cols + x))
+
+    def compute_contours(self):
+        """ This function traces the outer contour of the well from the label image, searching only inside the well bounding box."""
+        labels = self.get_labels()
+        x, y, w, h = self.get_bbox()
+        crop = np.zeros((h, w), dtype='uint8')
+        crop[labels[y:y+h, x:x+w] == self.get_label()] = 255
+        contours, hierarchy = cv2.findContours(crop, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=(x, y))
+        self.set_contours(max(contours, key=cv2.contourArea))
 
 class Well(Well_Mask):
-    def __init__(self, well, contours, area, mask):
-        super().__init__(well=well, contours=contours, area=area, mask=mask)
+    def __init__(self, well, contours, area, labels, bbox, indices=None, centroid=None):
+        super().__init__(well=well, contours=contours, area=area, labels=labels, bbox=bbox, indices=indices, centroid=centroid)
         self.__img = None
+        self.__intensities = None
+        self.__pixel_offset = (0, 0)
+        self.__histogram = None
         self.__mean = None
         self.__median = None
         self.__stdev = None
@@ -67,6 +140,14 @@ class Well(Well_Mask):
     def set_pixel_int_array(self, arr):
         self.__pixel_int_array = arr
 
+    def set_intensities(self, intensities, offset=(0, 0)):
+        """ This function sets the gathered intensities and the (dx, dy) offset of the well indices they were gathered at."""
+        self.__intensities = intensities
+        self.__pixel_offset = offset
+
+    def set_histogram(self, hist):
+        self.__histogram = hist
+
     def set_img(self, img):
         self.__img = img
 
@@ -91,9 +172,32 @@ class Well(Well_Mask):
     def get_img(self):
         return self.__img
 
+    def get_shape(self):
+        return None if self.__img is None else self.__img.shape
+
     def get_pixel_int_array(self):
+        # build the [row, col, intensity] array on demand from the cached indices
+        if self.__pixel_int_array is None and self.__intensities is not None:
+            rows, cols = np.unravel_index(self.get_pixel_indices(), self.get_img().shape)
+            self.__pixel_int_array = np.column_stack((rows, cols, self.__intensities))
         return self.__pixel_int_array
 
+    def get_intensities(self):
+        return self.__intensities
+
+    def get_pixel_offset(self):
+        return self.__pixel_offset
+
+    def get_pixel_indices(self):
+        """ This function returns the flat image indices of the intensities: the well indices shifted by the image drift (computed on demand)."""
+        return shift_indices(self.get_indices(), self.get_img().shape, self.__pixel_offset)
+
+    def get_histogram(self):
+        return self.__histogram
+
+    def get_percentile(self, q):
+        return histogram_percentile(self.get_histogram(), q)
+
     def get_mean(self):
         return self.__mean
     
@@ -123,53 +227,134 @@ class Well(Well_Mask):
         maximum = self.get_max()
         contours = self.get_contours()
         area = self.get_area()
-        pixel_int_array = self.get_pixel_int_array()
-        mask = self.get_mask()
+        intensities = self.get_intensities()
+        labels = self.get_labels()
         median = self.get_median()
 
-        print(f'Well Num: {well_num} | Img: {img.shape[1], img.shape[0]} | Contours: {contours.shape} | Pixel Int Array: {len(pixel_int_array)} | Mask: {mask.shape[1], mask.shape[0]}')
+        print(f'Well Num: {well_num} | Img: {(img.shape[1], img.shape[0]) if img is not None else None} | Contours: {contours.shape} | Pixel Int Array: {len(intensities) if intensities is not None else None} | Mask: {labels.shape[1], labels.shape[0]}')
         print(f'Area: {area} | Mean: {mean} | Stdev: {stdev} | Mode: {mode} | Median: {median} | Minimum: {minimum} | Maximum: {maximum}')
 
         
-    def get_pixels_from_mask(self, img):
-        """ This function uses the well mask to extract the pixels for that well. It sets the pixel_int_array with the corresponding pixel points and there intensities.
+    def get_pixels_from_mask(self, img, offset=(0, 0)):
+        """ This function uses the well's cached mask indices to extract the pixels for that well with a single vectorized gather. 
+        It sets the intensities for the well; the pixel_int_array of [row, col, intensity] points is built from them on demand.
+        offset is the (dx, dy) drift of the image from the mask image; the pixels are gathered at the well indices shifted by it (the well's
+        own indices are left as they are) and pixels moved out of the image are dropped. Returns the shifted indices.
         
         """
-        WHITE = 255
         self.set_img(img)
-        # Access the image pixels and create a 1D numpy array then add to list
-        pts = np.where(self.get_mask() == WHITE)
-        assert len(pts[0]) == len(pts[1]), "Mask does not give x, y pts of even length"
+        # compute the indices once if the mask was not initialized with them
+        if self.get_indices() is None:
+            self.compute_indices()
+        pixel_indices = shift_indices(self.get_indices(), img.shape, offset)
 
-        well_pix = []
-        for pt in zip(pts[0], pts[1]):
-            well_pix.append([pt[0], pt[1], img[pt[0], pt[1]]])
-
-        self.set_pixel_int_array(well_pix)
+        # gather the well intensities from the flattened image
+        self.set_intensities(np.take(img, pixel_indices), offset)
+        self.set_pixel_int_array(None)
+        return pixel_indices
 
     
     def get_well_statistics(self):
-        """ This function uses the pixel_int_array to extract statistics about the img.
+        """ This function uses the well intensities to extract statistics about the img.
+        The intensities are binned into a histogram once and every statistic is derived from it, rather than making a pass (and a sort for the median) per statistic.
+        """
+
+        int_array = self.get_intensities()
+        hist = intensity_histogram(int_array)
+        self.set_histogram(hist)
+        self.set_statistics(histogram_statistics(hist, dtype=int_array.dtype))
+
+    def get_result(self, keep_pixels=False):
+        """ This function returns a compact Well_Result holding the well statistics without the image, mask or pixel references.
+        With keep_pixels the gathered intensities are kept with a reference to the shared mask indices and the offset they were gathered at,
+        so the pixel_int_array can still be rebuilt without each result holding its own shifted index array.
         """
+        keep_pixels = keep_pixels and self.get_intensities() is not None
+        return Well_Result(well=self.get_well_num(), area=self.get_area(), mean=self.get_mean(), stdev=self.get_stdev(), median=self.get_median(),
+                           mode=self.get_mode(), minimum=self.get_min(), maximum=self.get_max(),
+                           indices=self.get_indices() if keep_pixels else None,
+                           shape=self.get_img().shape if keep_pixels else None,
+                           offset=self.get_pixel_offset() if keep_pixels else (0, 0),
+                           intensities=self.get_intensities() if keep_pixels else None)
+
+    def set_statistics(self, stats):
+        """ This function sets the well statistics from a HistogramStatistics result."""
+        logger.debug(f'Well Num: {self.get_well_num()} | Area: {self.get_area()} | Mean: {stats.mean} | Stdev: {stats.stdev} | Mode: {stats.mode} | Median: {stats.median} | Minimum: {stats.minimum} | Maximum: {stats.maximum}')
+
+        self.set_mean(stats.mean)
+        self.set_max(stats.maximum)
+        self.set_min(stats.minimum)
+        self.set_mode(stats.mode)
+        self.set_stdev(stats.stdev)
+        self.set_median(stats.median)
+
+
+class Well_Result:
+    """ Compact per well result record for one image. It uses __slots__ and only holds the scalar statistics
+    (plus optionally the well intensities), so long runs use memory proportional to the result table rather than the images.
+    """
+    __slots__ = ('__well_num', '__area', '__mean', '__stdev', '__median', '__mode', '__minimum', '__maximum', '__indices', '__shape', '__offset', '__intensities')
+
+    def __init__(self, well, area, mean, stdev, median, mode, minimum, maximum, indices=None, shape=None, offset=(0, 0), intensities=None):
+        self.__well_num = well
+        self.__area = area
+        self.__mean = mean
+        self.__stdev = stdev
+        self.__median = median
+        self.__mode = mode
+        self.__minimum = minimum
+        self.__maximum = maximum
+        self.__indices = indices
+        self.__shape = shape
+        self.__offset = offset
+        self.__intensities = intensities
+
+    def get_well_num(self):
+        return self.__well_num
 
-        pixelArray = self.get_pixel_int_array()
-        int_array = []
-        for pix in pixelArray:
-            int_array.append(pix[2])
+    def get_area(self):
+        return self.__area
 
-        mean = np.mean(int_array)
-        stdev = np.std(int_array)
-        mode = st.mode(int_array)
-        minimum = np.min(int_array)
-        maximum = np.max(int_array)
-        median = np.median(int_array)
+    def get_mean(self):
+        return self.__mean
 
-        print(f'Well Num: {self.get_well_num()} | Area: {self.get_area()} | Mean: {mean} | Stdev: {stdev} | Mode: {mode} | Median: {median} | Minimum: {minimum} | Maximum: {maximum}')
+    def get_stdev(self):
+        return self.__stdev
 
-        self.set_mean(mean)
-        self.set_max(maximum)
-        self.set_min(minimum)
-        self.set_mode(mode)
-        self.set_stdev(stdev)
-        self.set_median(median)
+    def get_median(self):
+        return self.__median
 
+    def get_mode(self):
+        return self.__mode
+
+    def get_min(self):
+        return self.__minimum
+
+    def get_max(self):
+        return self.__maximum
+
+    def get_intensities(self):
+        return self.__intensities
+
+    def get_indices(self):
+        return self.__indices
+
+    def get_shape(self):
+        return self.__shape
+
+    def get_pixel_offset(self):
+        return self.__offset
+
+    def get_pixel_indices(self):
+        """ This function returns the flat image indices of the intensities: the shared mask indices shifted by the offset."""
+        return None if self.__indices is None else shift_indices(self.__indices, self.__shape, self.__offset)
+
+    def get_pixel_int_array(self):
+        # rebuilt on demand, the record only keeps the intensities, the shared mask indices and the offset
+        if self.__intensities is None:
+            return None
+        rows, cols = np.unravel_index(self.get_pixel_indices(), self.__shape)
+        return np.column_stack((rows, cols, self.__intensities))
+
+    def print_all(self):
+        print(f'Well Num: {self.__well_num} | Area: {self.__area} | Mean: {self.__mean} | Stdev: {self.__stdev} | Mode: {self.__mode} | Median: {self.__median} | Minimum: {self.__minimum} | Maximum: {self.__maximum}')